@@ -0,0 +1,221 @@
+"""
+Microbenchmarks de los caminos calientes de parseo y precio, sobre
+fixtures sintéticas con el formato de Google Custom Search
+(benchmarks/fixtures, generadas por benchmarks/generar_fixtures.py).
+
+Por caso reporta ops/seg, pico de memoria asignada por operación y
+bloques asignados que quedan vivos (tracemalloc):
+
+- benchmarks/baseline.json guarda solo el `resultado` esperado de cada
+  caso, que no depende de la máquina: si cambia es una regresión de
+  parseo/precio y siempre falla;
+- ops/seg y memoria solo se comparan contra una corrida guardada con
+  `--guardar` en la misma máquina y el mismo job (p. ej. el commit base
+  en el mismo runner de CI), con `--comparar-con`: caer más de la
+  tolerancia falla.
+
+    python benchmarks/bench.py                                   # solo resultados
+    python benchmarks/bench.py --update-baseline                 # tras un cambio intencional de resultados
+    python benchmarks/bench.py --guardar /tmp/base.json          # en el commit base
+    python benchmarks/bench.py --comparar-con /tmp/base.json     # en el commit a evaluar
+    python benchmarks/bench.py --only extract
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RONDAS = 10
+
+# Importar main crea las bases SQLite de las caches: que queden en un directorio temporal
+_tmp = tempfile.mkdtemp(prefix="bench-")
+os.environ.setdefault("PATENTE_CACHE_PATH", os.path.join(_tmp, "patente_cache.sqlite3"))
+os.environ.setdefault("LISTINGS_STORE_PATH", os.path.join(_tmp, "listings.sqlite3"))
+os.environ.setdefault("PRICE_MODELS_PATH", os.path.join(_tmp, "price_models.sqlite3"))
+os.environ.setdefault("JOBS_PATH", os.path.join(_tmp, "jobs.sqlite3"))
+os.environ.setdefault("GOOGLE_QUOTA_PATH", os.path.join(_tmp, "google_quota.sqlite3"))
+os.environ.setdefault("PREWARM_ENABLED", "0")
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import pandas as pd  # noqa: E402
+
+from scrap_pipeline import custom_split, extract_custom_info, parse_google_items  # noqa: E402
+from main import filtrar_comparables, estimar_precio  # noqa: E402
+from listing_cache import normalizar_query  # noqa: E402
+
+
+def cargar_fixtures() -> list:
+    fixtures = []
+    for archivo in sorted(os.listdir(FIXTURES_DIR)):
+        if archivo.endswith(".json"):
+            with open(os.path.join(FIXTURES_DIR, archivo), encoding="utf-8") as f:
+                fixtures.append((archivo[:-len(".json")], json.load(f)))
+    return fixtures
+
+
+def _textos(fixture: dict) -> list:
+    return [item["title"] + " " + item["snippet"] for item in fixture["items"]]
+
+
+def casos(nombre: str, fixture: dict) -> list:
+    """(nombre del caso, función sin argumentos, función que resume el resultado para comparar)."""
+    brand, model, year = fixture["brand"], fixture["model"], fixture["year"]
+    items = fixture["items"]
+    textos = _textos(fixture)
+    sub_textos = [t for texto in textos for t in custom_split(texto, ";")]
+    df = parse_google_items(brand, model, items)
+    # Una búsqueda típica mezcla lo recién scrapeado con lo del store (con repetidos)
+    df_mezcla = pd.concat([df, df], ignore_index=True)
+    comparables = filtrar_comparables(df_mezcla, year)
+    km = int(comparables.km.dropna().median()) if comparables.km.notna().any() else 50_000
+
+    def resumen_df(resultado):
+        return {"filas": len(resultado), "suma_precio": int(resultado.price.sum())}
+
+    return [
+        (f"custom_split[{nombre}]",
+         lambda: [custom_split(texto, ";") for texto in textos],
+         lambda r: sum(len(partes) for partes in r)),
+        (f"extract_custom_info[{nombre}]",
+         lambda: [extract_custom_info(brand, model, texto) for texto in sub_textos],
+         lambda r: sum(1 for fila in r if fila["price"] is not None)),
+        (f"extract_listings[{nombre}]",
+         lambda: parse_google_items(brand, model, items),
+         resumen_df),
+        (f"filtrar_comparables[{nombre}]",
+         lambda: filtrar_comparables(df_mezcla, year),
+         resumen_df),
+        (f"regresion_km[{nombre}]",
+         lambda: estimar_precio(comparables, km, normalizar_query(brand, model, year)),
+         lambda r: round(float(r[0]))),
+    ]
+
+
+def medir(func, min_time: float) -> dict:
+    # Calentar (cachés de regex, imports perezosos de pandas)
+    func()
+
+    # Suficientes repeticiones para durar ~min_time; la mejor de RONDAS rondas filtra el ruido de la máquina
+    n = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(n):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / RONDAS:
+            break
+        n *= 2
+    best = elapsed
+    for _ in range(RONDAS - 1):
+        start = time.perf_counter()
+        for _ in range(n):
+            func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    resultado = func()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    bloques = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    return {
+        "ops_per_sec": round(n / best, 1),
+        "peak_kib": round((peak - base) / 1024, 1),
+        "alloc_blocks": bloques,
+        "_resultado": resultado,
+    }
+
+
+def maquina() -> dict:
+    """Lo que hace comparables dos corridas: mismo host, CPU e intérprete."""
+    return {"host": platform.node(), "cpu": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version()}
+
+
+def comparar(actual: dict, esperado: dict, referencia: dict, tolerancia: float) -> list:
+    problemas = []
+    if esperado is not None and actual["resultado"] != esperado.get("resultado"):
+        problemas.append(f"resultado {actual['resultado']!r} != baseline {esperado.get('resultado')!r}")
+    if referencia is not None:
+        if actual["ops_per_sec"] < referencia["ops_per_sec"] * (1 - tolerancia):
+            problemas.append(f"ops/seg {actual['ops_per_sec']} < referencia {referencia['ops_per_sec']}")
+        if actual["peak_kib"] > referencia["peak_kib"] * (1 + tolerancia) + 1:
+            problemas.append(f"pico {actual['peak_kib']} KiB > referencia {referencia['peak_kib']} KiB")
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de parseo y precio")
+    parser.add_argument("--update-baseline", action="store_true", help="guardar los resultados esperados en el baseline")
+    parser.add_argument("--guardar", help="guardar esta corrida (ops/seg y memoria) en este archivo")
+    parser.add_argument("--comparar-con", help="corrida guardada con --guardar en esta misma máquina")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="regresión tolerada en ops/seg y memoria (0.3 = 30%%)")
+    parser.add_argument("--min-time", type=float, default=1.0, help="segundos aproximados de medición por caso")
+    parser.add_argument("--only", default="", help="solo los casos cuyo nombre contiene este texto")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    referencia = {}
+    if args.comparar_con:
+        with open(args.comparar_con, encoding="utf-8") as f:
+            guardada = json.load(f)
+        referencia = guardada["casos"]
+        if guardada.get("maquina") != maquina():
+            print(f"AVISO: la corrida de referencia es de otra máquina ({guardada.get('maquina')}): "
+                  f"los ops/seg no son comparables")
+
+    resultados = {}
+    fallas = 0
+    print(f"{'caso':<50} {'ops/seg':>12} {'pico KiB':>10} {'bloques':>9}  vs referencia")
+    for nombre, fixture in cargar_fixtures():
+        for caso, func, resumen in casos(nombre, fixture):
+            if args.only not in caso:
+                continue
+            medicion = medir(func, args.min_time)
+            medicion["resultado"] = resumen(medicion.pop("_resultado"))
+            resultados[caso] = medicion
+
+            ref = referencia.get(caso)
+            problemas = comparar(medicion, baseline.get(caso), ref, args.tolerance)
+            estado = f"{medicion['ops_per_sec'] / ref['ops_per_sec']:5.2f}x" if ref else ""
+            if problemas:
+                estado += "  REGRESIÓN: " + "; ".join(problemas)
+            fallas += bool(problemas)
+            print(f"{caso:<50} {medicion['ops_per_sec']:>12,.1f} {medicion['peak_kib']:>10,.1f} {medicion['alloc_blocks']:>9}  {estado}")
+
+    if args.update_baseline:
+        baseline.update({caso: {"resultado": m["resultado"]} for caso, m in resultados.items()})
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline actualizado: {BASELINE_PATH}")
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump({"maquina": maquina(), "casos": resultados}, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Corrida guardada: {args.guardar}")
+        return 0
+
+    if fallas:
+        print(f"{fallas} caso(s) con regresión")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Presupuesto de arranque en frío de `main:app`.
+
+En intérpretes nuevos mide el tiempo de `import main` más el arranque
+del lifespan (sin precalentamientos en segundo plano), muestra el
+reporte de `python -X importtime` con los módulos más caros y falla si:
+
+- la mediana supera el presupuesto (`--budget`, en segundos), o
+- `import main` cargó alguna dependencia pesada que debe ser perezosa
+  (warmup.HEAVY_MODULES: pandas, numpy, httpx, requests, Selenium).
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --budget 1.5 --runs 7
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEDIR = """
+import sys, time, json, asyncio
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+import warmup
+cargados = [m for m in warmup.HEAVY_MODULES if m in sys.modules]
+
+async def arrancar():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+t2 = asyncio.run(arrancar())
+print(json.dumps({"import": t1 - t0, "arranque": t2 - t0, "pesados": cargados}))
+"""
+
+
+def _env(tmp: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "PATENTE_CACHE_PATH": os.path.join(tmp, "patente_cache.sqlite3"),
+        "LISTINGS_STORE_PATH": os.path.join(tmp, "listings.sqlite3"),
+        "PRICE_MODELS_PATH": os.path.join(tmp, "price_models.sqlite3"),
+        "JOBS_PATH": os.path.join(tmp, "jobs.sqlite3"),
+        "PROGRESS_BUS_PATH": os.path.join(tmp, "progress_bus.sqlite3"),
+        "GOOGLE_QUOTA_PATH": os.path.join(tmp, "google_quota.sqlite3"),
+        "PATENTE_POOL_WARM": "0",
+        "PREWARM_ENABLED": "0",
+        "WARMUP_ENABLED": "0",
+    })
+    return env
+
+
+def medir(env: dict) -> dict:
+    out = subprocess.run([sys.executable, "-c", MEDIR], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def importtime(env: dict, top: int) -> list:
+    """(ms acumulados, ms propios, módulo) de los imports más caros de `import main`."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    filas = []
+    for linea in out.stderr.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        propio, acumulado, modulo = linea[len("import time:"):].split("|")
+        filas.append((int(acumulado) / 1000, int(propio) / 1000, modulo.rstrip()))
+    return sorted(filas, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Presupuesto de arranque en frío de main:app")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("COLD_START_BUDGET", "1.0")),
+                        help="segundos máximos (mediana) para import + lifespan")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20, help="módulos a mostrar del reporte de importtime")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="cold-start-") as tmp:
+        env = _env(tmp)
+
+        print(f"{'acumulado ms':>13} {'propio ms':>10}  módulo")
+        for acumulado, propio, modulo in importtime(env, args.top):
+            print(f"{acumulado:>13.1f} {propio:>10.1f}  {modulo}")
+
+        corridas = [medir(env) for _ in range(args.runs)]
+
+    imports = statistics.median(c["import"] for c in corridas)
+    arranque = statistics.median(c["arranque"] for c in corridas)
+    pesados = sorted({m for c in corridas for m in c["pesados"]})
+    print(f"\nimport main: {imports:.3f}s  import + lifespan: {arranque:.3f}s  "
+          f"(mediana de {args.runs}, presupuesto {args.budget:.3f}s)")
+
+    fallas = []
+    if arranque > args.budget:
+        fallas.append(f"arranque {arranque:.3f}s supera el presupuesto de {args.budget:.3f}s")
+    if pesados:
+        fallas.append(f"`import main` cargó dependencias que deben ser perezosas: {', '.join(pesados)}")
+    for falla in fallas:
+        print(f"FALLA: {falla}")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
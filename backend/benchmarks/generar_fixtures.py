@@ -0,0 +1,73 @@
+"""
+Genera las fixtures de benchmark con el formato de una respuesta de
+Google Custom Search (`items` con `title` y `snippet`) para búsquedas en
+chileautos.cl. Es determinista (semilla fija): regenerarlas no cambia
+los resultados esperados del baseline.
+
+    python benchmarks/generar_fixtures.py
+"""
+import os
+import json
+import random
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# (archivo, marca, modelo, año, versiones, precio base, cantidad de items)
+BUSQUEDAS = [
+    ("honda_civic_2016.json", "honda", "civic", 2016, ["EXL 1.8 Aut", "LX 1.8", "EX 1.8 Aut", "Si 2.0"], 10_500_000, 10),
+    ("toyota_hilux_2020.json", "toyota", "hilux", 2020, ["SRV 2.8 4x4 Aut", "SR 2.4 4x2", "DX 2.4 4x4"], 24_000_000, 10),
+    ("hyundai_tucson_2019_100.json", "hyundai", "tucson", 2019, ["GL 2.0", "GLS 2.0 Aut", "Limited 2.0 AWD"], 14_500_000, 100),
+]
+
+COMBUSTIBLES = ["Bencina", "Diésel", "Híbrido"]
+REGIONES = ["Región Metropolitana", "Valparaíso", "Biobío", "Los Lagos", "Antofagasta"]
+
+
+def _miles(valor: int) -> str:
+    return f"{valor:,}".replace(",", ".")
+
+
+def _publicacion(rng, marca, modelo, año, versiones, precio_base):
+    año_pub = año if rng.random() < 0.75 else año + rng.choice([-2, -1, 1])
+    km = rng.randrange(5_000, 180_000, 500)
+    precio = int(precio_base * (1 - km / 600_000) * rng.uniform(0.9, 1.1)) // 10_000 * 10_000
+    nombre = f"{marca.title()} {modelo.title()} {rng.choice(versiones)} {año_pub}"
+
+    partes = [nombre]
+    if rng.random() < 0.93:
+        partes.append(f"${_miles(precio)}")
+    if rng.random() < 0.85:
+        partes.append(f"{_miles(km)} km")
+    partes.append(rng.choice(COMBUSTIBLES))
+    partes.append(rng.choice(REGIONES))
+    return " · ".join(partes)
+
+
+def item_busqueda(rng, marca, modelo, año, versiones, precio_base):
+    publicaciones = [_publicacion(rng, marca, modelo, año, versiones, precio_base) for _ in range(rng.randint(1, 4))]
+    return {
+        "kind": "customsearch#result",
+        "title": f"{marca.title()} {modelo.title()} {año} usados en venta | Chileautos",
+        "link": f"https://www.chileautos.cl/vehiculos/{marca}/{modelo}/{año}/",
+        "displayLink": "www.chileautos.cl",
+        "snippet": "; ".join(publicaciones) + "; Encuentra autos usados y nuevos en Chile.",
+    }
+
+
+def main():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for archivo, marca, modelo, año, versiones, precio_base, cantidad in BUSQUEDAS:
+        rng = random.Random(archivo)
+        fixture = {
+            "brand": marca,
+            "model": modelo,
+            "year": año,
+            "items": [item_busqueda(rng, marca, modelo, año, versiones, precio_base) for _ in range(cantidad)],
+        }
+        with open(os.path.join(FIXTURES_DIR, archivo), "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+        print(f"{archivo}: {cantidad} items")
+
+
+if __name__ == "__main__":
+    main()
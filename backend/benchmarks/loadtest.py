@@ -0,0 +1,459 @@
+"""
+Prueba de carga de punta a punta, sin red: levanta servidores locales que
+imitan a Google Custom Search (JSON con publicaciones de chileautos) y a
+patentechile.com (formulario + tabla de resultados), con latencia y tasa
+de errores configurables, arranca el backend con uvicorn apuntando a
+ellos y lo ejercita con `--concurrencia` clientes por escenario:
+
+- `valuar`: POST /valuar (tasación de ejemplo, no llama a los upstreams:
+  mide el piso del servidor)
+- `progreso`: POST /valuar-con-progreso
+- `ws`: abre /ws/{session_id} y valúa con progreso en esa sesión
+
+Por escenario reporta latencia p50/p95/p99, throughput y errores (en `ws`
+además el tiempo al primer mensaje y si llegó el 100%), y la memoria
+(RSS) del proceso del backend durante la prueba.
+
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --concurrencia 50 --duracion 60 --escenarios progreso,ws
+    python benchmarks/loadtest.py --latencia-google 0.8 --errores-google 0.2 --json resultado.json
+
+Las valuaciones con progreso incluyen las pausas deliberadas entre
+mensajes (unos 5 s), así que su latencia nunca baja de eso; compare
+throughput y p95/p99 con la misma `--concurrencia`.
+"""
+import os
+import sys
+import json
+import zlib
+import time
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from generar_fixtures import item_busqueda  # noqa: E402
+
+ESCENARIOS = ("valuar", "progreso", "ws")
+
+# (marca, modelo, versiones, precio base de un auto del año)
+CATALOGO = [
+    ("honda", "civic", ["EXL 1.8 Aut", "LX 1.8", "EX 1.8 Aut", "Si 2.0"], 10_500_000),
+    ("toyota", "hilux", ["SRV 2.8 4x4 Aut", "SR 2.4 4x2", "DX 2.4 4x4"], 24_000_000),
+    ("hyundai", "tucson", ["GL 2.0", "GLS 2.0 Aut", "Limited 2.0 AWD"], 14_500_000),
+    ("toyota", "corolla", ["XLI 1.8", "GLI 1.8 Aut", "SEG 1.8 CVT"], 11_000_000),
+    ("nissan", "sentra", ["Sense 1.8", "Advance 1.8 CVT", "Exclusive 1.8 CVT"], 9_800_000),
+    ("chevrolet", "cruze", ["LT 1.4T", "LTZ 1.4T Aut", "Premier 1.4T"], 9_500_000),
+    ("mazda", "cx-5", ["R 2.0", "V 2.5 AWD Aut", "GT 2.5 AWD"], 16_000_000),
+    ("kia", "sportage", ["EX 2.0", "LX 2.0 Aut", "GT Line 2.0 AWD"], 13_500_000),
+]
+AÑOS = range(2012, 2023)
+
+
+def vehiculo(indice: int) -> tuple:
+    """(marca, modelo, año) determinista del vehículo número `indice`."""
+    marca, modelo, _, _ = CATALOGO[indice % len(CATALOGO)]
+    return marca, modelo, AÑOS[(indice // len(CATALOGO)) % len(AÑOS)]
+
+
+def patente(indice: int) -> str:
+    """Patente ficticia (cuatro letras y dos dígitos) que lleva codificado el número del vehículo."""
+    letras, digitos = divmod(indice, 100)
+    return "".join(chr(65 + letras // 26 ** i % 26) for i in (3, 2, 1, 0)) + f"{digitos:02d}"
+
+
+def _indice_patente(texto: str) -> int:
+    # Inversa de `patente()`; cualquier otra patente cae en el primer vehículo
+    try:
+        letras = 0
+        for letra in texto[:4]:
+            letras = letras * 26 + ord(letra) - 65
+        return letras * 100 + int(texto[4:6])
+    except ValueError:
+        return 0
+
+
+class _Stub(BaseHTTPRequestHandler):
+    """Base de los servidores falsos: latencia con jitter y errores inyectados."""
+    latencia = 0.0
+    errores = 0.0
+    stats = None
+    stats_lock = None
+
+    def log_message(self, *args):
+        pass
+
+    def _esperar_o_fallar(self) -> bool:
+        if self.latencia:
+            time.sleep(self.latencia * random.uniform(0.5, 1.5))
+        falla = random.random() < self.errores
+        # ThreadingHTTPServer atiende cada request en su propio hilo
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            if falla:
+                self.stats["errores"] += 1
+        if falla:
+            self.send_response(random.choice([500, 502, 503]))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return True
+        return False
+
+    def _responder(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class GoogleStub(_Stub):
+    """GET /customsearch/v1?q=marca modelo año&start=N con 1 a 3 páginas de resultados por búsqueda."""
+
+    def do_GET(self):
+        if self._esperar_o_fallar():
+            return
+        params = parse_qs(urlparse(self.path).query)
+        q = params.get("q", [""])[0]
+        start = int(params.get("start", ["1"])[0])
+        palabras = q.split()
+
+        items = []
+        rng = random.Random(f"{q}|{start}")
+        if len(palabras) >= 3 and palabras[-1].isdigit() and start <= 10 * (1 + zlib.crc32(q.encode("utf-8")) % 3):
+            marca, modelo, año = palabras[0], " ".join(palabras[1:-1]), int(palabras[-1])
+            _, _, versiones, precio = next((c for c in CATALOGO if c[:2] == (marca, modelo)),
+                                           (marca, modelo, ["Base"], 10_000_000))
+            precio_año = int(precio * max(0.4, 1 - 0.06 * (2024 - año)))
+            items = [item_busqueda(rng, marca, modelo, año, versiones, precio_año) for _ in range(10)]
+        self._responder(json.dumps({"items": items}).encode("utf-8"), "application/json; charset=UTF-8")
+
+
+class PatenteStub(_Stub):
+    """GET / con el formulario (#txtTerm + campo oculto) y POST /buscar con la tabla del vehículo."""
+
+    FORMULARIO = ('<html><body><form action="/buscar" method="post">'
+                  '<input type="hidden" name="token" value="prueba-de-carga">'
+                  '<input id="txtTerm" name="term"><button>Buscar</button></form></body></html>').encode("utf-8")
+
+    def do_GET(self):
+        if not self._esperar_o_fallar():
+            self._responder(self.FORMULARIO, "text/html; charset=utf-8")
+
+    def do_POST(self):
+        largo = int(self.headers.get("Content-Length", "0"))
+        datos = parse_qs(self.rfile.read(largo).decode("utf-8"))
+        if self._esperar_o_fallar():
+            return
+        marca, modelo, año = vehiculo(_indice_patente(datos.get("term", [""])[0].upper()))
+        filas = "".join(f"<tr><td>{campo}:</td><td>{valor}</td></tr>"
+                        for campo, valor in (("Marca", marca.upper()), ("Modelo", modelo.upper()), ("Año", año)))
+        self._responder(f"<html><body><table><tbody>{filas}</tbody></table></body></html>".encode("utf-8"),
+                        "text/html; charset=utf-8")
+
+
+def iniciar_stub(handler, latencia: float, errores: float) -> ThreadingHTTPServer:
+    clase = type(handler.__name__, (handler,), {"latencia": latencia, "errores": errores,
+                                                 "stats": {"requests": 0, "errores": 0},
+                                                 "stats_lock": threading.Lock()})
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), clase)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _env_backend(tmp: str, google: ThreadingHTTPServer, patentes: ThreadingHTTPServer) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "GOOGLE_API_URL": f"http://127.0.0.1:{google.server_port}/customsearch/v1",
+        "GOOGLE_API_KEY": "prueba-de-carga",
+        "GOOGLE_CX": "prueba-de-carga",
+        "PATENTECHILE_URL": f"http://127.0.0.1:{patentes.server_port}/",
+        # Sin navegador: todo debe quedar en los servidores locales
+        "PATENTE_LOOKUP_MODE": "http_only",
+        "PATENTE_POOL_WARM": "0",
+        "ML_ENABLED": "0",
+        "PREWARM_ENABLED": "0",
+        "PATENTE_CACHE_PATH": os.path.join(tmp, "patente_cache.sqlite3"),
+        "LISTINGS_STORE_PATH": os.path.join(tmp, "listings.sqlite3"),
+        "PRICE_MODELS_PATH": os.path.join(tmp, "price_models.sqlite3"),
+        "JOBS_PATH": os.path.join(tmp, "jobs.sqlite3"),
+        "PROGRESS_BUS_PATH": os.path.join(tmp, "progress_bus.sqlite3"),
+        "GOOGLE_QUOTA_PATH": os.path.join(tmp, "google_quota.sqlite3"),
+        "PROFILING_DIR": os.path.join(tmp, "perfiles"),
+    })
+    # Cuota de Google holgada salvo que se pida otra cosa: se mide el backend, no el límite
+    env.setdefault("GOOGLE_QUOTA_PER_DAY", "1000000")
+    env.setdefault("GOOGLE_QUOTA_PER_SECOND", "1000")
+    env.setdefault("GOOGLE_QUOTA_BURST", "1000")
+    return env
+
+
+def iniciar_backend(env: dict, port: int, log) -> subprocess.Popen:
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    import httpx
+
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El backend terminó al arrancar (código {proceso.returncode})")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proceso
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proceso.kill()
+    raise RuntimeError("El backend no respondió /health en 60 s")
+
+
+def rss_mib(pid: int):
+    """RSS actual del proceso en MiB (Linux, /proc), o None si no se puede leer."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MonitorMemoria:
+    def __init__(self, pid: int, intervalo: float = 0.2):
+        self.pid = pid
+        self.intervalo = intervalo
+        self.muestras = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            rss = rss_mib(self.pid)
+            if rss is not None:
+                self.muestras.append(rss)
+            if self._stop.wait(self.intervalo):
+                return
+
+    def resumen(self) -> dict:
+        if not self.muestras:
+            return {"rss_inicio_mib": None, "rss_pico_mib": None, "rss_fin_mib": None}
+        return {"rss_inicio_mib": round(self.muestras[0], 1), "rss_pico_mib": round(max(self.muestras), 1),
+                "rss_fin_mib": round(self.muestras[-1], 1)}
+
+
+def percentil(valores: list, p: float):
+    """Percentil por rango más cercano (valores ya ordenados)."""
+    if not valores:
+        return None
+    return valores[min(len(valores) - 1, max(0, round(p / 100 * len(valores) + 0.5) - 1))]
+
+
+def _payload(rng: random.Random, vehiculos: int, frac_patentes: float, kilometros: bool = True) -> dict:
+    indice = rng.randrange(vehiculos)
+    body = {"kilometers": rng.randrange(10_000, 180_000, 1_000)} if kilometros else {}
+    if rng.random() < frac_patentes:
+        body["patente"] = patente(indice)
+    else:
+        marca, modelo, año = vehiculo(indice)
+        body["vehicle_data"] = {"brand": marca, "model": modelo, "year": año}
+    return body
+
+
+async def _valuar(client, base: str, body: dict) -> dict:
+    t0 = time.perf_counter()
+    resp = await client.post(f"{base}/valuar", json=body)
+    return {"latencia": time.perf_counter() - t0, "status": resp.status_code}
+
+
+async def _progreso(client, base: str, body: dict) -> dict:
+    t0 = time.perf_counter()
+    resp = await client.post(f"{base}/valuar-con-progreso", json=body)
+    return {"latencia": time.perf_counter() - t0, "status": resp.status_code}
+
+
+async def _ws(client, base: str, body: dict) -> dict:
+    import websockets
+
+    session_id = str(uuid.uuid4())
+    t0 = time.perf_counter()
+    primero, mensajes, completo = None, 0, False
+    async with websockets.connect(f"{base.replace('http', 'ws', 1)}/ws/{session_id}", max_queue=None) as ws:
+        async def leer():
+            nonlocal primero, mensajes, completo
+            async for raw in ws:
+                mensaje = json.loads(raw)
+                if mensaje.get("type") == "heartbeat":
+                    continue
+                mensajes += 1
+                if primero is None:
+                    primero = time.perf_counter() - t0
+                if mensaje.get("percentage") == 100:
+                    completo = True
+                    return
+
+        lector = asyncio.create_task(leer())
+        resp = await client.post(f"{base}/valuar-con-progreso", json={**body, "session_id": session_id})
+        latencia = time.perf_counter() - t0
+        try:
+            # El último mensaje puede llegar justo después de la respuesta HTTP
+            await asyncio.wait_for(lector, 2 if resp.status_code == 200 else 0.1)
+        except asyncio.TimeoutError:
+            pass
+    return {"latencia": latencia, "status": resp.status_code, "primer_mensaje": primero,
+            "mensajes": mensajes, "completo": completo}
+
+
+async def correr_escenario(escenario: str, base: str, args) -> dict:
+    import httpx
+
+    hacer = {"valuar": _valuar, "progreso": _progreso, "ws": _ws}[escenario]
+    resultados = []
+    fin = time.monotonic() + args.duracion
+    limits = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        async def cliente(n: int):
+            rng = random.Random(f"{escenario}-{n}")
+            while time.monotonic() < fin:
+                body = _payload(rng, args.vehiculos, args.patentes, kilometros=rng.random() < 0.8)
+                try:
+                    resultados.append(await hacer(client, base, body))
+                except Exception as e:
+                    resultados.append({"latencia": None, "status": type(e).__name__})
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(cliente(n) for n in range(args.concurrencia)))
+        duracion = time.perf_counter() - t0
+
+    return resumir(escenario, resultados, duracion)
+
+
+def resumir(escenario: str, resultados: list, duracion: float) -> dict:
+    ok = [r for r in resultados if r["status"] == 200]
+    latencias = sorted(r["latencia"] for r in ok)
+    estados = {}
+    for r in resultados:
+        estados[str(r["status"])] = estados.get(str(r["status"]), 0) + 1
+
+    resumen = {
+        "escenario": escenario,
+        "requests": len(resultados),
+        "ok": len(ok),
+        "estados": estados,
+        "throughput_rps": round(len(ok) / duracion, 2) if duracion else 0.0,
+        **{f"p{p}_ms": None if not latencias else round(percentil(latencias, p) * 1000, 1) for p in (50, 95, 99)},
+        "max_ms": round(latencias[-1] * 1000, 1) if latencias else None,
+    }
+    if escenario == "ws":
+        primeros = sorted(r["primer_mensaje"] for r in ok if r["primer_mensaje"] is not None)
+        resumen["primer_mensaje_p50_ms"] = round(percentil(primeros, 50) * 1000, 1) if primeros else None
+        resumen["primer_mensaje_p95_ms"] = round(percentil(primeros, 95) * 1000, 1) if primeros else None
+        resumen["mensajes_por_valuacion"] = round(sum(r["mensajes"] for r in ok) / len(ok), 1) if ok else None
+        resumen["sin_mensaje_final"] = sum(1 for r in ok if not r["completo"])
+    return resumen
+
+
+def imprimir(resumen: dict):
+    print(f"\n== {resumen['escenario']}: {resumen['requests']} requests, {resumen['ok']} ok, "
+          f"{resumen['throughput_rps']} req/s")
+    print(f"   latencia p50 {resumen['p50_ms']} ms  p95 {resumen['p95_ms']} ms  "
+          f"p99 {resumen['p99_ms']} ms  max {resumen['max_ms']} ms")
+    print(f"   estados: {resumen['estados']}")
+    if resumen["escenario"] == "ws":
+        print(f"   primer mensaje p50 {resumen['primer_mensaje_p50_ms']} ms  p95 {resumen['primer_mensaje_p95_ms']} ms  "
+              f"mensajes/valuación {resumen['mensajes_por_valuacion']}  sin 100%: {resumen['sin_mensaje_final']}")
+    print(f"   memoria backend: RSS inicio {resumen['rss_inicio_mib']} MiB  pico {resumen['rss_pico_mib']} MiB  "
+          f"fin {resumen['rss_fin_mib']} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del backend contra upstreams locales")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS),
+                        help=f"escenarios separados por coma ({', '.join(ESCENARIOS)})")
+    parser.add_argument("--concurrencia", type=int, default=10, help="clientes simultáneos por escenario")
+    parser.add_argument("--duracion", type=float, default=20, help="segundos por escenario")
+    parser.add_argument("--timeout", type=float, default=60, help="timeout (s) de cada request")
+    parser.add_argument("--vehiculos", type=int, default=40, help="vehículos distintos (define el hit rate de las caches)")
+    parser.add_argument("--patentes", type=float, default=0.3, help="fracción de valuaciones por patente")
+    parser.add_argument("--latencia-google", type=float, default=0.15, help="latencia media (s) del falso Google")
+    parser.add_argument("--errores-google", type=float, default=0.0, help="fracción de respuestas 5xx del falso Google")
+    parser.add_argument("--latencia-patente", type=float, default=0.3, help="latencia media (s) del falso patentechile")
+    parser.add_argument("--errores-patente", type=float, default=0.0, help="fracción de respuestas 5xx del falso patentechile")
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    escenarios = [e.strip() for e in args.escenarios.split(",") if e.strip()]
+    desconocidos = set(escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        parser.error(f"escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+    google = iniciar_stub(GoogleStub, args.latencia_google, args.errores_google)
+    patentes = iniciar_stub(PatenteStub, args.latencia_patente, args.errores_patente)
+    resultados = []
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as tmp:
+        port = _puerto_libre()
+        with open(os.path.join(tmp, "backend.log"), "w+", encoding="utf-8") as log:
+            backend = iniciar_backend(_env_backend(tmp, google, patentes), port, log)
+            try:
+                for escenario in escenarios:
+                    with MonitorMemoria(backend.pid) as memoria:
+                        resumen = asyncio.run(correr_escenario(escenario, f"http://127.0.0.1:{port}", args))
+                    resumen.update(memoria.resumen())
+                    imprimir(resumen)
+                    resultados.append(resumen)
+            finally:
+                backend.terminate()
+                try:
+                    backend.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    backend.kill()
+            if backend.returncode not in (0, -15):
+                log.seek(0)
+                print("\nÚltimas líneas del log del backend:\n" + "".join(log.readlines()[-20:]))
+
+    upstreams = {}
+    for nombre, servidor in (("google", google), ("patentechile", patentes)):
+        with servidor.RequestHandlerClass.stats_lock:
+            upstreams[nombre] = dict(servidor.RequestHandlerClass.stats)
+    print(f"\nupstreams locales: {upstreams}")
+    google.shutdown()
+    patentes.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"parametros": vars(args), "escenarios": resultados, "upstreams": upstreams},
+                      f, ensure_ascii=False, indent=2)
+    return 0 if all(r["ok"] for r in resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
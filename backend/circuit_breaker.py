@@ -0,0 +1,207 @@
+import os
+import math
+import time
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+from stages import OverloadedError
+
+# Ventana de las últimas llamadas sobre la que se mide la tasa de fallas
+CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", "20"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+# Segundos que el circuito queda abierto antes de dejar pasar llamadas de prueba
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+# Segundos que una consulta que falló se rechaza sin volver a intentarla
+CIRCUIT_NEGATIVE_TTL = float(os.getenv("CIRCUIT_NEGATIVE_TTL", "30"))
+CIRCUIT_NEGATIVE_MAX = int(os.getenv("CIRCUIT_NEGATIVE_MAX", "10000"))
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+ESTADOS = {CERRADO: 0, SEMIABIERTO: 1, ABIERTO: 2}
+
+# nombre del upstream -> CircuitBreaker
+BREAKERS = {}
+
+
+class CircuitOpenError(OverloadedError):
+    """El upstream está marcado como caído (o esa consulta falló hace poco); `retry_after` en segundos."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Llamada:
+    """Resultado de una llamada dentro de `CircuitBreaker.llamada()`; una respuesta de error se marca con `exito = False`."""
+
+    def __init__(self):
+        self.exito = True
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por upstream, seguro entre threads.
+
+    Cerrado: todo pasa y se registra el resultado de las últimas `window`
+    llamadas; con al menos `min_calls` y una tasa de fallas (errores o
+    llamadas más lentas que `slow_seconds`) sobre `failure_rate` se abre.
+    Abierto: se rechaza al instante con CircuitOpenError durante
+    `open_seconds`. Semiabierto: pasan hasta `half_open_probes` llamadas
+    de prueba; si una resulta bien se cierra, si falla se vuelve a abrir.
+
+    Además, las claves (patente, búsqueda) que fallaron se rechazan por
+    `negative_ttl` segundos aunque el circuito siga cerrado.
+    """
+
+    def __init__(self, name: str, slow_seconds: float = None, window: int = CIRCUIT_WINDOW,
+                 min_calls: int = CIRCUIT_MIN_CALLS, failure_rate: float = CIRCUIT_FAILURE_RATE,
+                 open_seconds: float = CIRCUIT_OPEN_SECONDS, half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES,
+                 negative_ttl: float = CIRCUIT_NEGATIVE_TTL, negative_max: int = CIRCUIT_NEGATIVE_MAX):
+        self.name = name
+        self.slow_seconds = slow_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.negative_ttl = negative_ttl
+        self.negative_max = negative_max
+        self._lock = threading.Lock()
+        self._fallas = deque(maxlen=window)  # True = falla
+        self._estado = CERRADO
+        self._abierto_hasta = 0.0
+        self._sondas = 0
+        self._fallidas = OrderedDict()  # clave -> expira (monotonic)
+        self.stats = {"exitos": 0, "fallas": 0, "lentas": 0, "rechazadas": 0, "rechazadas_por_clave": 0,
+                      "aperturas": 0}
+        BREAKERS[name] = self
+
+    def rechazo(self, key=None):
+        """El error con que se rechazaría una llamada ahora, o None. No consume llamadas de prueba."""
+        with self._lock:
+            return self._rechazo(key, time.monotonic(), consumir=False)
+
+    def admitir(self, key=None):
+        """Lanza CircuitOpenError si la llamada no debe hacerse; en semiabierto la cuenta como prueba."""
+        with self._lock:
+            error = self._rechazo(key, time.monotonic(), consumir=True)
+        if error is not None:
+            raise error
+
+    def _rechazo(self, key, now: float, consumir: bool):
+        if key is not None:
+            expira = self._fallidas.get(key)
+            if expira is not None and expira > now:
+                self.stats["rechazadas_por_clave"] += 1
+                return CircuitOpenError(f"La consulta a {self.name} falló hace poco, intente más tarde", expira - now)
+            self._fallidas.pop(key, None)
+
+        if self._estado == ABIERTO:
+            if now < self._abierto_hasta:
+                self.stats["rechazadas"] += 1
+                return CircuitOpenError(f"{self.name} no está disponible, intente más tarde", self._abierto_hasta - now)
+            self._estado = SEMIABIERTO
+            self._sondas = 0
+        if self._estado == SEMIABIERTO:
+            if self._sondas >= self.half_open_probes:
+                self.stats["rechazadas"] += 1
+                return CircuitOpenError(f"{self.name} se está reintentando, intente más tarde", 1)
+            if consumir:
+                self._sondas += 1
+        return None
+
+    def registrar(self, exito: bool, duracion: float = 0.0):
+        lenta = self.slow_seconds is not None and duracion > self.slow_seconds
+        falla = not exito or lenta
+        now = time.monotonic()
+        with self._lock:
+            self.stats["fallas" if falla else "exitos"] += 1
+            if lenta:
+                self.stats["lentas"] += 1
+
+            if self._estado == SEMIABIERTO:
+                self._sondas = max(0, self._sondas - 1)
+                if falla:
+                    self._abrir(now)
+                else:
+                    self._estado = CERRADO
+                    self._fallas.clear()
+                return
+
+            self._fallas.append(falla)
+            if (self._estado == CERRADO and len(self._fallas) >= self.min_calls
+                    and sum(self._fallas) / len(self._fallas) >= self.failure_rate):
+                self._abrir(now)
+
+    def liberar(self):
+        """La llamada se canceló sin resultado: devuelve su lugar de prueba sin registrar nada."""
+        with self._lock:
+            if self._estado == SEMIABIERTO:
+                self._sondas = max(0, self._sondas - 1)
+
+    def recordar_falla(self, key):
+        with self._lock:
+            self._fallidas[key] = time.monotonic() + self.negative_ttl
+            self._fallidas.move_to_end(key)
+            while len(self._fallidas) > self.negative_max:
+                self._fallidas.popitem(last=False)
+
+    def _abrir(self, now: float):
+        self._estado = ABIERTO
+        self._abierto_hasta = now + self.open_seconds
+        self._fallas.clear()
+        self.stats["aperturas"] += 1
+        print(f"Circuito de {self.name} abierto por {self.open_seconds:.0f}s")
+
+    @contextmanager
+    def llamada(self, key=None):
+        """
+        Admite, mide y registra una llamada al upstream. Una excepción
+        cuenta como falla (y deja `key` en la cache negativa); una
+        cancelación no cuenta.
+        """
+        self.admitir(key)
+        llamada = Llamada()
+        start = time.monotonic()
+        try:
+            yield llamada
+        except Exception:
+            self.registrar(False, time.monotonic() - start)
+            if key is not None:
+                self.recordar_falla(key)
+            raise
+        except BaseException:
+            self.liberar()
+            raise
+        self.registrar(llamada.exito, time.monotonic() - start)
+        if not llamada.exito and key is not None:
+            self.recordar_falla(key)
+
+    def estado(self) -> str:
+        with self._lock:
+            if self._estado == ABIERTO and time.monotonic() >= self._abierto_hasta:
+                return SEMIABIERTO
+            return self._estado
+
+    def report(self) -> dict:
+        estado = self.estado()
+        with self._lock:
+            fallas = list(self._fallas)
+            reabre_en = max(0.0, self._abierto_hasta - time.monotonic()) if estado == ABIERTO else 0.0
+            claves = len(self._fallidas)
+        return {
+            "estado": estado,
+            "llamadas_ventana": len(fallas),
+            "tasa_fallas": round(sum(fallas) / len(fallas), 3) if fallas else 0.0,
+            "reabre_en_segundos": round(reabre_en, 1),
+            "claves_fallidas": claves,
+            **self.stats,
+        }
+
+
+def report() -> dict:
+    return {name: breaker.report() for name, breaker in BREAKERS.items()}
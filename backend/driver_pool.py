@@ -0,0 +1,183 @@
+import os
+import sys
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+POOL_SIZE = int(os.getenv("PATENTE_POOL_SIZE", "2"))
+DRIVER_MAX_USES = int(os.getenv("PATENTE_DRIVER_MAX_USES", "50"))
+ACQUIRE_TIMEOUT = float(os.getenv("PATENTE_POOL_TIMEOUT", "30"))
+
+
+class PoolExhaustedError(RuntimeError):
+    """No se liberó ningún navegador dentro del timeout."""
+
+
+def crear_driver():
+    # Selenium se importa al crear el primer navegador, no al arrancar el servidor
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    # No esperar imágenes/CSS: las esperas explícitas deciden cuándo está lista la página
+    options.page_load_strategy = "eager"
+
+    if sys.platform == "win32":
+        # Windows: usar ChromeDriverManager
+        from selenium.webdriver.chrome.service import Service
+        from webdriver_manager.chrome import ChromeDriverManager
+        return webdriver.Chrome(
+            service=Service(ChromeDriverManager().install()),
+            options=options
+        )
+
+    # Linux / Docker: usar Chromium instalado
+    options.binary_location = "/usr/bin/chromium"
+    return webdriver.Chrome(options=options)
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+
+
+class DriverPool:
+    """
+    Pool acotado de navegadores headless ya lanzados.
+
+    Cada driver se presta con `with pool.driver() as driver:`, se limpia al
+    devolverlo y se recicla tras `max_uses` usos o si falla el health check.
+    Nunca hay más de `size` Chromium vivos a la vez.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, max_uses: int = DRIVER_MAX_USES, factory=crear_driver):
+        self.size = size
+        self.max_uses = max_uses
+        self._factory = factory
+        # LIFO: reutilizar primero el driver más reciente (más "caliente")
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._alive = 0
+        self._closed = False
+
+    def warm(self, n: Optional[int] = None):
+        """Lanza navegadores hasta tener `n` (por defecto `size`) listos para usar."""
+        target = self.size if n is None else min(n, self.size)
+        while True:
+            with self._lock:
+                if self._closed or self._alive >= target:
+                    return
+                self._alive += 1
+            try:
+                pooled = _PooledDriver(self._factory())
+            except Exception as e:
+                with self._lock:
+                    self._alive -= 1
+                print(f"No se pudo precalentar el navegador: {e}")
+                return
+            if self._closed:
+                self._discard(pooled)
+                return
+            self._idle.put(pooled)
+
+    def stats(self) -> dict:
+        return {"size": self.size, "alive": self._alive, "idle": self._idle.qsize()}
+
+    @contextmanager
+    def driver(self, timeout: float = ACQUIRE_TIMEOUT):
+        from selenium.common.exceptions import WebDriverException
+
+        pooled = self._acquire(timeout)
+        broken = False
+        try:
+            yield pooled.driver
+        except WebDriverException:
+            # Chromium caído o sesión inválida: no devolverlo al pool
+            broken = True
+            raise
+        finally:
+            self._release(pooled, broken)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+
+    def _acquire(self, timeout: float) -> _PooledDriver:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._closed:
+                        raise RuntimeError("El pool de navegadores está cerrado")
+                    can_create = self._alive < self.size
+                    if can_create:
+                        self._alive += 1
+                if can_create:
+                    try:
+                        return _PooledDriver(self._factory())
+                    except Exception:
+                        with self._lock:
+                            self._alive -= 1
+                        raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(f"Ningún navegador disponible tras {timeout}s")
+                try:
+                    # Espera corta: si otro hilo descarta un driver se libera cupo para crear uno
+                    pooled = self._idle.get(timeout=min(remaining, 0.5))
+                except queue.Empty:
+                    continue
+
+            if self._healthy(pooled):
+                return pooled
+            self._discard(pooled)
+
+    def _release(self, pooled: _PooledDriver, broken: bool):
+        pooled.uses += 1
+        if broken or self._closed or pooled.uses >= self.max_uses or not self._reset(pooled):
+            self._discard(pooled)
+            return
+        self._idle.put(pooled)
+
+    @staticmethod
+    def _healthy(pooled: _PooledDriver) -> bool:
+        try:
+            return pooled.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(pooled: _PooledDriver) -> bool:
+        try:
+            pooled.driver.delete_all_cookies()
+            pooled.driver.get("about:blank")
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, pooled: _PooledDriver):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._alive -= 1
+
+
+driver_pool = DriverPool()
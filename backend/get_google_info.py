@@ -6,34 +6,94 @@
 # )
 # from crawl4ai.extraction_strategy import JsonCssExtractionStrategy
 
-import requests
+import asyncio
+import random
+import time
 import os
 
+from metrics import UPSTREAM_SECONDS, UPSTREAM_REQUESTS
+from quota import quota, QuotaExceededError, INTERACTIVA
+from circuit_breaker import CircuitBreaker
+from stages import run_stage
+
 API_KEY = os.getenv("GOOGLE_API_KEY")
 CX = os.getenv("GOOGLE_CX")
+GOOGLE_API_URL = os.getenv("GOOGLE_API_URL", "https://www.googleapis.com/customsearch/v1")
+GOOGLE_TIMEOUT = float(os.getenv("GOOGLE_TIMEOUT", "10"))
+GOOGLE_MAX_RETRIES = int(os.getenv("GOOGLE_MAX_RETRIES", "3"))
+GOOGLE_BACKOFF = float(os.getenv("GOOGLE_BACKOFF", "0.5"))
+# Respuestas más lentas que esto cuentan como falla para el circuit breaker
+GOOGLE_CIRCUIT_SLOW = float(os.getenv("GOOGLE_CIRCUIT_SLOW", "5"))
+
+google_breaker = CircuitBreaker("google_cse", slow_seconds=GOOGLE_CIRCUIT_SLOW)
+
+# Motivos con que Custom Search responde un 403 por cuota (un 403 sin ellos es clave inválida, API deshabilitada...)
+_QUOTA_REASONS = {"dailyLimitExceeded", "rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+
+# Sesión HTTP compartida (keep-alive) para el cliente síncrono, se crea al primer uso
+_session = None
+# Cliente async compartido, se crea al primer uso dentro del event loop
+_client = None
+
 
+def _params(query: str, start: int) -> dict:
+    return {
+        "key": API_KEY,
+        "cx": CX,
+        "q": query,
+        "num": 10,  # última página puede ser <10
+        "start": start
+    }
 
-def google_api_scrap(query: str, n: int = 10):
+
+def _cuota_de_google(resp) -> str:
+    """
+    "dia" o "minuto" si la respuesta es el aviso de cuota agotada de Google
+    (429, o 403 con un motivo de cuota), None si no lo es.
+    """
+    if resp.status_code not in (403, 429):
+        return None
+    try:
+        error = resp.json().get("error") or {}
+    except ValueError:
+        error = {}
+    motivos = {e.get("reason") for e in error.get("errors") or []}
+    if resp.status_code == 403 and not motivos & _QUOTA_REASONS:
+        return None
+    if "userRateLimitExceeded" in motivos or "per minute" in (error.get("message") or "").lower():
+        return "minuto"
+    return "dia"
+
+
+def _retry_after(resp, default: float = 60) -> float:
+    try:
+        return float(resp.headers.get("Retry-After", default))
+    except ValueError:
+        return default
+
+
+def google_api_scrap(query: str, n: int = 10, prioridad: str = INTERACTIVA):
     """
     Busca en Google Custom Search y devuelve hasta n resultados.
     Maneja automáticamente la paginación.
     """
-    url = "https://www.googleapis.com/customsearch/v1"
     results = []
 
     # Calcular cuántas páginas necesito (10 resultados por request)
     for i in range(n // 10):
         start = i * 10 + 1
-        params = {
-            "key": API_KEY,
-            "cx": CX,
-            "q": query,
-            "num": 10,  # última página puede ser <10
-            "start": start
-        }
-
-        resp = requests.get(url, params=params).json()
-        items = resp.get("items", [])
+        error = google_breaker.rechazo(query)
+        if error is not None:
+            raise error
+        quota.acquire_blocking(prioridad)
+        with google_breaker.llamada(query):
+            resp = _get_session().get(GOOGLE_API_URL, params=_params(query, start), timeout=GOOGLE_TIMEOUT)
+        motivo = _cuota_de_google(resp)
+        if motivo is not None:
+            retry_after = quota.agotar() if motivo == "dia" else _retry_after(resp)
+            raise QuotaExceededError("Google reporta la cuota de búsquedas agotada, intente más tarde", retry_after)
+        resp.raise_for_status()
+        items = resp.json().get("items", [])
         results.extend(items)
 
         # Si no hay más resultados, corto
@@ -43,6 +103,104 @@ def google_api_scrap(query: str, n: int = 10):
     return results  # limitar a n exacto
 
 
+def _get_session():
+    global _session
+    if _session is None:
+        import requests
+
+        _session = requests.Session()
+    return _session
+
+
+def _get_client() -> "httpx.AsyncClient":
+    # httpx se importa al primer uso: no pesa en el arranque del servidor
+    import httpx
+
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=GOOGLE_TIMEOUT,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _registrar(started: float, resultado: str):
+    UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream="google_cse")
+    UPSTREAM_REQUESTS.inc(upstream="google_cse", resultado=resultado)
+
+
+async def _fetch_page(client: "httpx.AsyncClient", query: str, start: int, prioridad: str = INTERACTIVA,
+                      presupuesto=None) -> list:
+    """
+    Una página de resultados, reintentando 5xx y errores de red con backoff
+    exponencial y jitter. Cada intento consume cuota (y un token de
+    `presupuesto`, si se pasa uno); sin cuota, local o según Google (429, o
+    403 por cuota), lanza QuotaExceededError sin reintentar. Otros 4xx
+    (clave inválida...) se propagan como HTTPStatusError. Con el circuito
+    abierto, o si esta búsqueda falló hace poco, lanza CircuitOpenError sin
+    llamar ni gastar cuota.
+    """
+    import httpx
+
+    for attempt in range(GOOGLE_MAX_RETRIES + 1):
+        last_attempt = attempt == GOOGLE_MAX_RETRIES
+        error = google_breaker.rechazo(query)
+        if error is not None:
+            raise error
+        if presupuesto is not None and not presupuesto.take():
+            raise QuotaExceededError("Presupuesto de precalentamiento agotado", presupuesto.retry_after())
+        await quota.acquire(prioridad)
+        started = time.perf_counter()
+        try:
+            with google_breaker.llamada() as llamada:
+                resp = await client.get(GOOGLE_API_URL, params=_params(query, start))
+                llamada.exito = resp.status_code < 500
+        except httpx.TransportError:
+            _registrar(started, "error" if last_attempt else "reintento")
+            if last_attempt:
+                google_breaker.recordar_falla(query)
+                raise
+        else:
+            motivo = _cuota_de_google(resp)
+            if motivo is not None:
+                _registrar(started, "sin_cuota")
+                # El contador local es por máquina: si Google dice que no queda, no queda para nadie
+                retry_after = await run_stage("store", quota.agotar) if motivo == "dia" else _retry_after(resp)
+                raise QuotaExceededError("Google reporta la cuota de búsquedas agotada, intente más tarde", retry_after)
+            if llamada.exito:
+                _registrar(started, "ok" if resp.is_success else "error")
+                resp.raise_for_status()
+                return resp.json().get("items", [])
+            _registrar(started, "error" if last_attempt else "reintento")
+            if last_attempt:
+                google_breaker.recordar_falla(query)
+                resp.raise_for_status()
+
+        await asyncio.sleep(random.uniform(0, GOOGLE_BACKOFF * 2 ** attempt))
+
+
+async def google_api_pages(query: str, max_pages: int = 10, prioridad: str = INTERACTIVA, presupuesto=None):
+    """
+    Genera los items de cada página (start=1, 11, 21...) a medida que
+    llegan, una página a la vez: quien consume decide si pedir la
+    siguiente. Termina con la primera página vacía.
+    """
+    client = _get_client()
+    for i in range(max_pages):
+        items = await _fetch_page(client, query, i * 10 + 1, prioridad, presupuesto)
+        if not items:
+            return
+        yield items
+
+
 # async def google_scrap(url):
 #     import asyncio
 #     import sys
@@ -1,64 +1,248 @@
-import sys
+import os
 import time
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from bs4 import BeautifulSoup
+import threading
+from urllib.parse import urljoin
+
+from lxml import html as lxml_html
+
+from driver_pool import driver_pool
+from patente_cache import patente_cache, normalizar_patente
+from single_flight import SingleFlight
+from stages import run_stage
+from metrics import medir_upstream
+from circuit_breaker import CircuitBreaker
+
+PATENTECHILE_URL = os.getenv("PATENTECHILE_URL", "https://www.patentechile.com/")
+PAGE_TIMEOUT = float(os.getenv("PATENTE_PAGE_TIMEOUT", "15"))
+# "http": envío directo del formulario y navegador solo si falla; "http_only": sin navegador; "browser": siempre navegador
+LOOKUP_MODE = os.getenv("PATENTE_LOOKUP_MODE", "http")
+HTTP_TIMEOUT = float(os.getenv("PATENTE_HTTP_TIMEOUT", "10"))
+# Cada cuánto se vuelve a leer el formulario (acción, campos ocultos) de la página
+FORM_TTL = float(os.getenv("PATENTE_FORM_TTL", "600"))
+# Consultas más lentas que esto (HTTP más navegador) cuentan como falla para el circuit breaker
+PATENTE_CIRCUIT_SLOW = float(os.getenv("PATENTE_CIRCUIT_SLOW", "20"))
+
+USER_AGENT = ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/126.0 Safari/537.36")
+
+patente_flight = SingleFlight()
+patente_breaker = CircuitBreaker("patentechile", slow_seconds=PATENTE_CIRCUIT_SLOW)
+
+
+def _tabla_resultados(driver):
+    from selenium.webdriver.common.by import By
+
+    # Lista cuando aparece al menos una fila "campo: valor" del resultado
+    return driver.find_elements(By.CSS_SELECTOR, "tbody tr td:nth-child(2)")
+
+
+class FastPathError(RuntimeError):
+    """La consulta HTTP directa no sirvió (formulario cambió, página con JS, bloqueo): usar el navegador."""
+
+
+class _FormularioPatente:
+    """
+    Envío del formulario de búsqueda de patentechile.com sin navegador.
+
+    La primera vez (y cada `ttl` segundos) se lee la página para obtener
+    acción, método y campos del formulario que contiene `#txtTerm`; con eso
+    cada consulta es un solo request sobre una sesión HTTP compartida.
+    """
+
+    def __init__(self, url: str = PATENTECHILE_URL, timeout: float = HTTP_TIMEOUT, ttl: float = FORM_TTL):
+        self.url = url
+        self.timeout = timeout
+        self.ttl = ttl
+        self._session = None
+        self._lock = threading.Lock()
+        self._spec = None
+        self._spec_at = 0.0
+
+    def consultar(self, patente: str) -> dict:
+        spec = self._form_spec()
+        try:
+            return self._enviar(spec, patente)
+        except FastPathError:
+            # Quizás vencieron los campos ocultos (token): releer el formulario una vez
+            self.invalidar()
+            return self._enviar(self._form_spec(), patente)
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+            self._session.headers["User-Agent"] = USER_AGENT
+        return self._session
+
+    def invalidar(self):
+        with self._lock:
+            self._spec = None
+
+    def _form_spec(self) -> dict:
+        with self._lock:
+            if self._spec is not None and time.monotonic() - self._spec_at < self.ttl:
+                return self._spec
+
+        resp = self.session.get(self.url, timeout=self.timeout)
+        resp.raise_for_status()
+        doc = lxml_html.fromstring(resp.content, base_url=resp.url, parser=_parser(resp))
+        forms = doc.xpath('//form[.//input[@id="txtTerm"]]')
+        if not forms:
+            raise FastPathError("No se encontró el formulario de búsqueda")
+        form = forms[0]
+        campo = form.xpath('.//input[@id="txtTerm"]')[0].get("name")
+        if not campo:
+            raise FastPathError("El campo de patente no tiene nombre")
+
+        spec = {
+            "action": urljoin(resp.url, form.get("action") or resp.url),
+            "method": (form.get("method") or "get").lower(),
+            "campo": campo,
+            "campos": {k: v for k, v in form.form_values() if k != campo},
+        }
+        with self._lock:
+            self._spec = spec
+            self._spec_at = time.monotonic()
+        return spec
+
+    def _enviar(self, spec: dict, patente: str) -> dict:
+        data = {**spec["campos"], spec["campo"]: patente}
+        if spec["method"] == "post":
+            resp = self.session.post(spec["action"], data=data, timeout=self.timeout)
+        else:
+            resp = self.session.get(spec["action"], params=data, timeout=self.timeout)
+        resp.raise_for_status()
+
+        datos = _parse_tabla(resp.content, _parser(resp))
+        if not datos:
+            # Sin tabla no se distingue "patente inexistente" de "resultado cargado por JS"
+            raise FastPathError("La respuesta no trae la tabla de resultados")
+        return datos
+
+
+def _parser(resp):
+    # Sin charset en los headers el sitio sirve UTF-8 (requests asumiría latin-1)
+    content_type = resp.headers.get("Content-Type", "").lower()
+    return lxml_html.HTMLParser(encoding=resp.encoding if "charset" in content_type else "utf-8")
+
+
+_formulario = _FormularioPatente()
+
 
 def get_info_by_patente(patente):
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-
-    if sys.platform == "win32":
-        # Windows: usar ChromeDriverManager
-        from selenium.webdriver.chrome.service import Service
-        from webdriver_manager.chrome import ChromeDriverManager
-        driver = webdriver.Chrome(
-            service=Service(ChromeDriverManager().install()),
-            options=options
-        )
-    else:
-        # Linux / Docker: usar Chromium instalado
-        options.binary_location = "/usr/bin/chromium"
-        driver = webdriver.Chrome(options=options)
+    """
+    Datos del vehículo para una patente. Consulta primero la cache y solo
+    si la patente no está (o venció) va a patentechile.com.
+    """
+    datos = patente_cache.get(patente)
+    if datos is None:
+        datos = _scrap_patente(patente)
+        patente_cache.set(patente, datos)
+    return datos
 
-    try:
-        driver.get("https://www.patentechile.com/")
-        time.sleep(2)
-        print('here 2')
 
-        driver.save_screenshot("patente.png")
+async def get_info_by_patente_async(patente):
+    """
+    Versión async para el event loop: corre en el executor de etapas y
+    agrupa consultas simultáneas de la misma patente en una sola.
+
+    Con patentechile.com caído (circuito abierto) o si la patente falló
+    hace poco, solo se responde desde la cache: sin ocupar navegadores ni
+    threads de la etapa, y si no está cacheada se lanza CircuitOpenError.
+    """
+    key = normalizar_patente(patente)
+    error = patente_breaker.rechazo(key)
+    if error is not None:
+        datos = await run_stage("store", patente_cache.get, patente)
+        if datos is None:
+            raise error
+        return datos
+
+    return await patente_flight.do(key, lambda: run_stage("patente", get_info_by_patente, patente))
+
+
+async def refresh_patente_async(patente):
+    """Vuelve a consultar patentechile.com y renueva la cache (precalentamiento)."""
+    error = patente_breaker.rechazo(normalizar_patente(patente))
+    if error is not None:
+        raise error
+
+    def refresh():
+        # Un refresco fallido (el navegador devuelve {}) no pisa una entrada buena
+        return patente_cache.set_refreshed(patente, _scrap_patente(patente))
+
+    return await patente_flight.do(normalizar_patente(patente), lambda: run_stage("patente", refresh))
+
+
+def _scrap_patente(patente):
+    """
+    Un round trip HTTP si se puede; el navegador queda como respaldo.
+    Ambos intentos cuentan como una sola llamada para el circuit breaker.
+    """
+    import requests
+
+    with patente_breaker.llamada(normalizar_patente(patente)):
+        if LOOKUP_MODE in ("http", "http_only"):
+            try:
+                with medir_upstream("patentechile_http"):
+                    return _formulario.consultar(patente)
+            except (FastPathError, requests.RequestException) as e:
+                if LOOKUP_MODE == "http_only":
+                    raise
+                print(f"Consulta HTTP de patente {patente} falló, usando navegador: {e}")
+        return _scrap_patente_navegador(patente)
+
+
+def _scrap_patente_navegador(patente):
+    # Selenium solo se importa si de verdad hace falta un navegador
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    with driver_pool.driver() as driver, medir_upstream("patentechile"):
+        wait = WebDriverWait(driver, PAGE_TIMEOUT, poll_frequency=0.1)
+
+        driver.get(PATENTECHILE_URL)
+        campo_patente = wait.until(EC.element_to_be_clickable((By.ID, "txtTerm")))
 
-        campo_patente = driver.find_element(By.ID, "txtTerm")
         campo_patente.clear()
         campo_patente.send_keys(patente)
         campo_patente.send_keys(Keys.RETURN)
-        time.sleep(3)
+
+        try:
+            wait.until(_tabla_resultados)
+        except TimeoutException:
+            # Patente sin resultados: se parsea lo que haya (normalmente nada)
+            pass
 
         html = driver.page_source
 
-    finally:
-        driver.quit()
+    return _parse_tabla(html)
 
-    # Parsear con BeautifulSoup
-    soup = BeautifulSoup(html, "lxml")
-    datos = {}
-    for fila in soup.select("tbody tr"):
-        celdas = fila.find_all("td")
-        if len(celdas) == 2:
-            campo = celdas[0].get_text(strip=True).replace(":", "")
-            valor = celdas[1].get_text(strip=True)
-            datos[campo] = valor
 
+def _parse_tabla(html, parser=None) -> dict:
+    """Solo las filas "campo: valor" de la tabla de resultados, con lxml."""
+    if not html or not html.strip():
+        return {}
+    datos = {}
+    for fila in lxml_html.fromstring(html, parser=parser).xpath("//tbody/tr[count(td)=2]"):
+        celdas = fila.xpath("./td")
+        campo = celdas[0].text_content().strip().replace(":", "")
+        valor = celdas[1].text_content().strip()
+        datos[campo] = valor
     return datos
 
 
 if __name__ == "__main__":
     patente = 'SGXR42'
-    datos = get_info_by_patente(patente)
+    try:
+        datos = get_info_by_patente(patente)
+    finally:
+        driver_pool.close()
     
     print(f"Resultado para {patente}:")
     for k, v in datos.items():
@@ -1,83 +1,180 @@
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
-from crawl4ai.extraction_strategy import JsonCssExtractionStrategy
-
-
-async def ml_scrap(query):
-    browser_conf = BrowserConfig(headless=True)  # or False to see the browser
-
-    schema = {
-        "name": "Available cars",
-        "baseSelector": "ol.ui-search-layout > li.ui-search-layout__item",
-        "fields": [
-            {
-                "name": "model",
-                "selector": "a.poly-component__title",
-                "type": "text",
-            },
-            {
-                "name": "price",
-                "selector": "span.andes-money-amount__fraction",
-                "type": "text",
-            },
-            {
-                "name": "year",
-                "selector": "ul.poly-attributes_list > li:first-child",
-                "type": "text",
-            },
-            {
-                "name": "km",
-                "selector": "ul.poly-attributes_list > li:last-child",
-                "type": "text",
-            },
-        ]
-    }
-
-    extraction_strategy = JsonCssExtractionStrategy(schema, verbose=True)
-
-    async with AsyncWebCrawler(config=browser_conf) as crawler:
-
-        # Paso 1: escribir query
-        config = CrawlerRunConfig(
-            js_code=[f"""
-            const input = document.querySelector('input.nav-search-input');
-            if (input) {{
-                input.value = '{query}';
-                return {{ queryValue: input.value }};
-            }}
-            """,
-            "document.querySelector('form.nav-search').submit();"],
-            extraction_strategy=extraction_strategy,
-            # wait_for="networkidle",
-            cache_mode=CacheMode.BYPASS,
-        )
-        result = await crawler.arun(url="https://www.mercadolibre.cl/", config=config)
-
-        # cars_info = json.loads(result.extracted_content)
-        # print(result.extracted_content)
-        # print(f"Successfully extracted {len(courses)} courses")
-        # print(result.markdown)
-        # print(result.url)
-        return result.extracted_content
+# crawl4ai es opcional: se importa al primer uso y sin él la fuente queda desactivada
+import os
+import json
+import asyncio
+import importlib.util
+from functools import lru_cache
+
+from metrics import medir_upstream
+
+ML_ENABLED = os.getenv("ML_ENABLED", "1") == "1"
+# Búsquedas simultáneas en el navegador compartido (una pestaña cada una)
+ML_MAX_CONCURRENCIA = int(os.getenv("ML_MAX_CONCURRENCIA", "2"))
+ML_URL = "https://www.mercadolibre.cl/"
+
+SCHEMA = {
+    "name": "Available cars",
+    "baseSelector": "ol.ui-search-layout > li.ui-search-layout__item",
+    "fields": [
+        {
+            "name": "model",
+            "selector": "a.poly-component__title",
+            "type": "text",
+        },
+        {
+            "name": "price",
+            "selector": "span.andes-money-amount__fraction",
+            "type": "text",
+        },
+        {
+            "name": "year",
+            "selector": "ul.poly-attributes_list > li:first-child",
+            "type": "text",
+        },
+        {
+            "name": "km",
+            "selector": "ul.poly-attributes_list > li:last-child",
+            "type": "text",
+        },
+    ]
+}
+
+# Crawler compartido (un navegador headless) y sus primitivas, creados al primer uso en el
+# event loop del servidor: las primitivas de asyncio no se pueden usar desde otro loop
+_loop = None
+_crawler = None
+_crawler_lock = None
+_pestanas = None
+
+
+@lru_cache(maxsize=1)
+def _crawl4ai_instalado() -> bool:
+    return importlib.util.find_spec("crawl4ai") is not None
+
+
+def motivo_desactivado():
+    """Por qué MercadoLibre no se consulta, o None si está activo."""
+    if not ML_ENABLED:
+        return "ML_ENABLED=0"
+    if not _crawl4ai_instalado():
+        return "crawl4ai no está instalado (pip install -r requirements-ml.txt && crawl4ai-setup)"
+    return None
+
+
+def disponible() -> bool:
+    return motivo_desactivado() is None
+
+
+def _primitivas():
+    global _loop, _crawler, _crawler_lock, _pestanas
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        # Primer uso, o un loop nuevo (el navegador del anterior murió con él)
+        _loop, _crawler = loop, None
+        _crawler_lock = asyncio.Lock()
+        _pestanas = asyncio.Semaphore(ML_MAX_CONCURRENCIA)
+    return _crawler_lock, _pestanas
+
+
+async def _get_crawler():
+    from crawl4ai import AsyncWebCrawler, BrowserConfig
+
+    global _crawler
+    lock, _ = _primitivas()
+    async with lock:
+        if _crawler is None:
+            crawler = AsyncWebCrawler(config=BrowserConfig(headless=True))
+            await crawler.start()
+            _crawler = crawler
+    return _crawler
+
+
+async def start_crawler():
+    """Levanta el navegador compartido por adelantado (lo llama el arranque del servidor)."""
+    try:
+        await _get_crawler()
+    except Exception as e:
+        print(f"No se pudo iniciar el crawler de MercadoLibre: {e}")
+
+
+async def close_crawler():
+    global _crawler
+    lock, _ = _primitivas()
+    async with lock:
+        if _crawler is not None:
+            crawler, _crawler = _crawler, None
+            await crawler.close()
+
+
+async def ml_scrap(query, crawler=None):
+    """
+    Busca `query` en MercadoLibre y devuelve el JSON extraído (texto).
+    Sin `crawler` usa el navegador compartido del proceso, con a lo más
+    ML_MAX_CONCURRENCIA pestañas a la vez; un crawler propio no las comparte.
+    """
+    from crawl4ai import CrawlerRunConfig, CacheMode
+    from crawl4ai.extraction_strategy import JsonCssExtractionStrategy
+
+    pestanas = None
+    if crawler is None:
+        crawler = await _get_crawler()
+        _, pestanas = _primitivas()
+
+    # Paso 1: escribir query (como literal JS: comillas en la búsqueda no rompen el script)
+    config = CrawlerRunConfig(
+        js_code=[f"""
+        const input = document.querySelector('input.nav-search-input');
+        if (input) {{
+            input.value = {json.dumps(query)};
+            return {{ queryValue: input.value }};
+        }}
+        """,
+        "document.querySelector('form.nav-search').submit();"],
+        extraction_strategy=JsonCssExtractionStrategy(SCHEMA),
+        cache_mode=CacheMode.BYPASS,
+    )
+    if pestanas is None:
+        return await _arun(crawler, config)
+    async with pestanas:
+        return await _arun(crawler, config)
+
+
+async def _arun(crawler, config):
+    with medir_upstream("mercadolibre"):
+        result = await crawler.arun(url=ML_URL, config=config)
+        if not result.success:
+            raise RuntimeError(f"MercadoLibre: {result.error_message}")
+    return result.extracted_content
+
+
+async def ml_listings(query) -> list:
+    """Publicaciones de MercadoLibre como dicts con `model` (título), `price`, `year` y `km` en texto."""
+    content = await ml_scrap(query)
+    return json.loads(content) if content else []
+
 
 def ml_scrap_sync(query):
-    import asyncio
     import sys
-    
+    from crawl4ai import AsyncWebCrawler, BrowserConfig
+
     if sys.platform == 'win32':
         # En Windows, configurar el event loop policy antes de crear el loop
         asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-    
+
+    async def buscar():
+        # Loop propio: no puede usar el navegador compartido del servidor
+        async with AsyncWebCrawler(config=BrowserConfig(headless=True)) as crawler:
+            return await ml_scrap(query, crawler)
+
     # Crear un nuevo event loop para este thread
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
-        return loop.run_until_complete(ml_scrap(query))
+        return loop.run_until_complete(buscar())
     finally:
         loop.close()
 
 if __name__ == "__main__":
-    import json
-    import asyncio
     query="honda civic"
-    cars_info = asyncio.run(ml_scrap(query))
+    cars_info = ml_scrap_sync(query)
     print(json.loads(cars_info))
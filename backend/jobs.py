@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import threading
+
+from stages import OverloadedError, run_stage
+from metrics import VALUACIONES
+
+JOBS_PATH = os.getenv("JOBS_PATH", "jobs.sqlite3")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_MAX_PENDIENTES = int(os.getenv("JOBS_MAX_PENDIENTES", "100"))
+JOBS_RESULT_TTL = float(os.getenv("JOBS_RESULT_TTL", "900"))
+# Cada cuánto se busca trabajo en la tabla y se revisa si pidieron cancelar uno en curso
+JOBS_POLL = float(os.getenv("JOBS_POLL", "0.5"))
+# Un trabajo en curso sin latido por este tiempo (worker caído) vuelve a la cola
+JOBS_LEASE = float(os.getenv("JOBS_LEASE", "30"))
+
+EN_COLA = "en_cola"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+ERROR = "error"
+CANCELADO = "cancelado"
+
+FINALES = (COMPLETADO, ERROR, CANCELADO)
+
+_COLUMNAS = "job_id, session_id, payload, prioridad, estado, resultado, error, created_at, started_at, finished_at"
+
+
+class Job:
+    def __init__(self, job_id: str, session_id: str, payload, prioridad: int, estado: str = EN_COLA,
+                 resultado=None, error: str = None, created_at: float = None, started_at: float = None,
+                 finished_at: float = None):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.payload = payload
+        self.prioridad = prioridad
+        self.estado = estado
+        self.resultado = resultado
+        self.error = error
+        self.created_at = time.time() if created_at is None else created_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+
+    @classmethod
+    def from_row(cls, row) -> "Job":
+        job_id, session_id, payload, prioridad, estado, resultado, error, created_at, started_at, finished_at = row
+        return cls(job_id, session_id, json.loads(payload) if payload else None, prioridad, estado,
+                   json.loads(resultado) if resultado else None, error, created_at, started_at, finished_at)
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "estado": self.estado,
+            "prioridad": self.prioridad,
+            "resultado": self.resultado,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Valuaciones asíncronas: `submit` devuelve el id de inmediato y un pool
+    fijo de `workers` tareas por proceso las ejecuta en orden de prioridad
+    (mayor primero, FIFO entre iguales). Los resultados se guardan
+    `result_ttl` segundos después de terminar.
+
+    Los trabajos viven en una tabla SQLite compartida por todos los
+    workers de la máquina: cualquiera puede consultarlos o cancelarlos,
+    cualquiera los toma de la cola (dentro de una transacción) y sobreviven
+    a un reinicio. Un trabajo en curso renueva su latido cada `poll`
+    segundos; si su worker muere, a los `lease` segundos vuelve a la cola.
+
+    `runner` es una corrutina `runner(payload, session_id)`; el payload
+    llega como dict (JSON) y el resultado debe tener `model_dump()` (un
+    modelo pydantic) o ser un dict.
+    """
+
+    def __init__(self, runner=None, path: str = JOBS_PATH, workers: int = JOBS_WORKERS,
+                 max_pendientes: int = JOBS_MAX_PENDIENTES, result_ttl: float = JOBS_RESULT_TTL,
+                 poll: float = JOBS_POLL, lease: float = JOBS_LEASE):
+        self.runner = runner
+        self.workers = workers
+        self.max_pendientes = max_pendientes
+        self.result_ttl = result_ttl
+        self.poll = poll
+        self.lease = lease
+        # Identifica a este proceso como dueño de los trabajos que toma
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " job_id TEXT NOT NULL UNIQUE,"
+            " session_id TEXT NOT NULL,"
+            " payload TEXT,"
+            " prioridad INTEGER NOT NULL,"
+            " estado TEXT NOT NULL,"
+            " resultado TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " owner TEXT,"
+            " heartbeat_at REAL,"
+            " cancelar INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_cola ON jobs(estado, prioridad DESC, id)")
+        self._running = {}  # job_id -> tarea de la valuación, solo los de este proceso
+        self._hay_trabajo = None
+        self._sondeo = None
+        self._tasks = []
+        self.stats = {"enviados": 0, "completados": 0, "errores": 0, "cancelados": 0, "rechazados": 0,
+                      "expirados": 0, "reencolados": 0}
+
+    def start(self):
+        if self._tasks:
+            return
+        self._hay_trabajo = asyncio.Event()
+        self._sondeo = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # Lo que quedó a medias lo retoma otro worker (o este mismo al reiniciar)
+        cantidad = self._transaction(lambda: self._liberar("owner = ?", (self.owner,)))
+        if cantidad:
+            print(f"{cantidad} trabajo(s) en curso volvieron a la cola al detener el servidor")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def submit(self, payload, session_id: str = None, prioridad: int = 0) -> Job:
+        if hasattr(payload, "model_dump"):
+            payload = payload.model_dump(mode="json")
+        job = Job(uuid.uuid4().hex, session_id or str(uuid.uuid4()), payload, prioridad)
+
+        def insertar():
+            self._purge()
+            (pendientes,) = self._db.execute("SELECT COUNT(*) FROM jobs WHERE estado = ?", (EN_COLA,)).fetchone()
+            if pendientes >= self.max_pendientes:
+                return False
+            self._db.execute(
+                "INSERT INTO jobs (job_id, session_id, payload, prioridad, estado, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.job_id, job.session_id, json.dumps(payload), prioridad, EN_COLA, job.created_at)
+            )
+            return True
+
+        if not self._transaction(insertar):
+            self.stats["rechazados"] += 1
+            raise OverloadedError("Demasiadas valuaciones en cola, intente más tarde")
+        self.stats["enviados"] += 1
+        if self._hay_trabajo is not None:
+            self._hay_trabajo.set()
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNAS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job.from_row(row)
+        if job.estado in FINALES and job.finished_at < time.time() - self.result_ttl:
+            return None
+        return job
+
+    def cancel(self, job_id: str):
+        """Cancela un trabajo en cola o en curso. Devuelve el trabajo, o None si no existe."""
+        def cancelar():
+            row = self._db.execute("SELECT estado FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == EN_COLA:
+                # Sale de la cola en el acto: estado final y sin payload
+                self._db.execute(
+                    "UPDATE jobs SET estado = ?, finished_at = ?, payload = NULL WHERE job_id = ?",
+                    (CANCELADO, time.time(), job_id)
+                )
+            elif row[0] == EN_CURSO:
+                # Lo cancela el worker que lo está ejecutando, en su siguiente latido
+                self._db.execute("UPDATE jobs SET cancelar = 1 WHERE job_id = ?", (job_id,))
+            return row[0]
+
+        estado = self._transaction(cancelar)
+        if estado == EN_COLA:
+            self._contar(CANCELADO)
+        elif estado == EN_CURSO and job_id in self._running:
+            self._running[job_id].cancel()
+        return self.get(job_id)
+
+    def pendientes(self) -> int:
+        return self._contar_estado(EN_COLA)
+
+    def en_curso(self) -> int:
+        return self._contar_estado(EN_CURSO)
+
+    def _contar_estado(self, estado: str) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE estado = ?", (estado,)).fetchone()[0]
+
+    async def _worker(self):
+        while True:
+            # Un solo worker ocioso por proceso consulta la tabla; los demás esperan su turno
+            async with self._sondeo:
+                job = await self._esperar_trabajo()
+            await self._run(job)
+
+    async def _esperar_trabajo(self) -> Job:
+        while True:
+            self._hay_trabajo.clear()
+            try:
+                job = await run_stage("store", self._claim)
+            except Exception as e:
+                print(f"Error tomando trabajos de la cola: {e}")
+                job = None
+            if job is not None:
+                return job
+            # asyncio.timeout y no wait_for: en 3.11 wait_for se traga la cancelación
+            # si el evento se activa justo al detener el pool, y stop() queda esperando
+            try:
+                async with asyncio.timeout(self.poll):
+                    await self._hay_trabajo.wait()
+            except TimeoutError:
+                pass
+
+    async def _run(self, job: Job):
+        task = asyncio.create_task(self.runner(job.payload, job.session_id))
+        self._running[job.job_id] = task
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.poll)
+                if done:
+                    break
+                if await run_stage("store", self._latido, job.job_id):
+                    task.cancel()
+            resultado = task.result()
+            if hasattr(resultado, "model_dump"):
+                resultado = resultado.model_dump(mode="json")
+            await run_stage("store", self._finish, job.job_id, COMPLETADO, resultado)
+        except asyncio.CancelledError:
+            if not task.done():
+                # Se está deteniendo el pool: no dejar la valuación colgando (stop() lo devuelve a la cola)
+                task.cancel()
+                raise
+            await run_stage("store", self._finish, job.job_id, CANCELADO)
+        except Exception as e:
+            await run_stage("store", self._finish, job.job_id, ERROR, None, f"Error al valuar vehículo: {str(e)}")
+        finally:
+            self._running.pop(job.job_id, None)
+
+    def _claim(self):
+        """Toma el siguiente trabajo de la cola (prioridad, luego orden de llegada), o None."""
+        # Lectura barata primero: con la cola vacía no se abre una transacción de escritura
+        with self._lock:
+            (hay_trabajo,) = self._db.execute(
+                "SELECT EXISTS (SELECT 1 FROM jobs WHERE estado = ?)"
+                " OR EXISTS (SELECT 1 FROM jobs WHERE estado = ? AND heartbeat_at < ?)",
+                (EN_COLA, EN_CURSO, time.time() - self.lease)
+            ).fetchone()
+        if not hay_trabajo:
+            return None
+
+        def tomar():
+            now = time.time()
+            reencolados = self._liberar("heartbeat_at < ?", (now - self.lease,))
+            row = self._db.execute(
+                f"SELECT {_COLUMNAS} FROM jobs WHERE estado = ? ORDER BY prioridad DESC, id LIMIT 1", (EN_COLA,)
+            ).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE jobs SET estado = ?, started_at = ?, owner = ?, heartbeat_at = ? WHERE job_id = ?",
+                    (EN_CURSO, now, self.owner, now, row[0])
+                )
+            return reencolados, row
+
+        reencolados, row = self._transaction(tomar)
+        if reencolados:
+            print(f"{reencolados} trabajo(s) en curso sin latido volvieron a la cola")
+        if row is None:
+            return None
+        job = Job.from_row(row)
+        job.estado = EN_CURSO
+        return job
+
+    def _latido(self, job_id: str) -> bool:
+        """Renueva el lease del trabajo; True si pidieron cancelarlo."""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND owner = ?",
+                             (time.time(), job_id, self.owner))
+            row = self._db.execute("SELECT cancelar FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def _finish(self, job_id: str, estado: str, resultado=None, error: str = None):
+        with self._lock:
+            actualizado = self._db.execute(
+                "UPDATE jobs SET estado = ?, resultado = ?, error = ?, finished_at = ?, payload = NULL, owner = NULL"
+                " WHERE job_id = ? AND owner = ? AND estado = ?",
+                (estado, json.dumps(resultado) if resultado is not None else None, error, time.time(),
+                 job_id, self.owner, EN_CURSO)
+            ).rowcount
+        # Si perdió el lease, el trabajo ya es de otro worker: este resultado no cuenta
+        if actualizado:
+            self._contar(estado)
+
+    def _contar(self, estado: str):
+        self.stats[{COMPLETADO: "completados", ERROR: "errores", CANCELADO: "cancelados"}[estado]] += 1
+        VALUACIONES.inc(endpoint="trabajos", resultado=estado)
+
+    def _liberar(self, condicion: str, params: tuple) -> int:
+        """
+        Devuelve a la cola los trabajos en curso que cumplen `condicion`; los
+        que tenían cancelación pedida quedan cancelados. Se llama dentro de
+        una transacción.
+        """
+        self._db.execute(
+            f"UPDATE jobs SET estado = ?, finished_at = ?, payload = NULL, owner = NULL"
+            f" WHERE estado = ? AND cancelar = 1 AND {condicion}",
+            (CANCELADO, time.time(), EN_CURSO, *params)
+        )
+        cantidad = self._db.execute(
+            f"UPDATE jobs SET estado = ?, owner = NULL, started_at = NULL WHERE estado = ? AND {condicion}",
+            (EN_COLA, EN_CURSO, *params)
+        ).rowcount
+        self.stats["reencolados"] += cantidad
+        return cantidad
+
+    def _purge(self):
+        # Se llama dentro de una transacción
+        vencidos = self._db.execute(
+            f"DELETE FROM jobs WHERE estado IN ({', '.join('?' * len(FINALES))}) AND finished_at < ?",
+            (*FINALES, time.time() - self.result_ttl)
+        ).rowcount
+        self.stats["expirados"] += vencidos
+
+    def _transaction(self, func):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = func()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return resultado
+
+
+job_manager = JobManager()
@@ -0,0 +1,99 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+FRESH_TTL = float(os.getenv("LISTING_CACHE_FRESH_TTL", str(6 * 3600)))
+STALE_TTL = float(os.getenv("LISTING_CACHE_STALE_TTL", str(3 * 24 * 3600)))
+MAX_ROWS = int(os.getenv("LISTING_CACHE_MAX_ROWS", "50000"))
+
+
+def normalizar_query(brand: str, model: str, year) -> tuple:
+    return (" ".join(brand.lower().split()), " ".join(model.lower().split()), int(year))
+
+
+class ListingCache:
+    """
+    Cache en memoria de publicaciones ya parseadas por (marca, modelo, año).
+    Guarda el DataFrame tal como sale del parser; los llamadores no deben modificarlo.
+
+    - Entrada fresca (< fresh_ttl): se devuelve directo.
+    - Entrada vencida pero < stale_ttl: se devuelve igual y se refresca en
+      segundo plano (stale-while-revalidate).
+    - Sin entrada: se espera el fetch.
+
+    Se desalojan las entradas menos usadas cuando el total de filas supera `max_rows`.
+    """
+
+    def __init__(self, fresh_ttl: float = FRESH_TTL, stale_ttl: float = STALE_TTL, max_rows: int = MAX_ROWS):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.max_rows = max_rows
+        self._entries = OrderedDict()  # key -> (fetched_at, rows)
+        self._rows = 0
+        self._refreshing = {}
+        self.stats = {"fresh_hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0, "evictions": 0}
+
+    async def get_or_fetch(self, key: tuple, fetch) -> list:
+        """`fetch` es una función sin argumentos que devuelve una corrutina con la lista de filas."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.fresh_ttl:
+                self._entries.move_to_end(key)
+                self.stats["fresh_hits"] += 1
+                return entry[1]
+            if age < self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stats["stale_hits"] += 1
+                self._schedule_refresh(key, fetch)
+                return entry[1]
+
+        self.stats["misses"] += 1
+        rows = await fetch()
+        self.set(key, rows)
+        return rows
+
+    def freshness_left(self, key: tuple):
+        """Segundos de frescura que le quedan a la entrada (negativo si ya venció, None si no existe)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return self.fresh_ttl - (time.monotonic() - entry[0])
+
+    async def refresh(self, key: tuple, fetch):
+        """Refresca la entrada ahora (lo usa el precalentamiento)."""
+        self.set(key, await fetch())
+        self.stats["refreshes"] += 1
+
+    def set(self, key: tuple, rows: list):
+        # Una búsqueda vacía (sin cuota, error upstream) no se cachea
+        if len(rows) == 0:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._rows -= len(old[1])
+        self._entries[key] = (time.monotonic(), rows)
+        self._rows += len(rows)
+        while self._rows > self.max_rows and len(self._entries) > 1:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._rows -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _schedule_refresh(self, key: tuple, fetch):
+        if key in self._refreshing:
+            return
+        self._refreshing[key] = asyncio.create_task(self._refresh(key, fetch))
+
+    async def _refresh(self, key: tuple, fetch):
+        try:
+            self.set(key, await fetch())
+            self.stats["refreshes"] += 1
+        except Exception as e:
+            self.stats["refresh_errors"] += 1
+            print(f"Error refrescando publicaciones {key}: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+
+listing_cache = ListingCache()
@@ -0,0 +1,145 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import TYPE_CHECKING
+
+from warmup import pandas
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+STORE_PATH = os.getenv("LISTINGS_STORE_PATH", "listings.sqlite3")
+STORE_MAX_AGE = float(os.getenv("LISTINGS_STORE_MAX_AGE", str(7 * 24 * 3600)))
+MIN_COMPARABLES = int(os.getenv("LISTINGS_MIN_COMPARABLES", "8"))
+
+COLUMNS = ["year", "price", "km", "brand", "model", "model_detail"]
+
+
+def _dedup_hash(source, brand, model, year, price, km, model_detail) -> str:
+    key = "|".join(str(v) for v in (source, brand, model, year, price, km, model_detail))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _none_if_na(value):
+    return None if pandas().isna(value) else value
+
+
+class ListingsStore:
+    """
+    Publicaciones persistidas en SQLite, indexadas por (marca, modelo, año).
+
+    Cada publicación se guarda una vez (hash de deduplicación); si vuelve a
+    aparecer solo se actualiza `fetched_at`, y `first_seen` conserva la
+    historia. Las valuaciones consultan aquí primero y solo se scrapea cuando
+    hay pocos comparables recientes.
+    """
+
+    def __init__(self, path: str = STORE_PATH, max_age: float = STORE_MAX_AGE, min_comparables: int = MIN_COMPARABLES):
+        self.max_age = max_age
+        self.min_comparables = min_comparables
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS listings ("
+            " id INTEGER PRIMARY KEY,"
+            " brand TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " year INTEGER,"
+            " price INTEGER,"
+            " km INTEGER,"
+            " model_detail TEXT,"
+            " source TEXT NOT NULL,"
+            " first_seen REAL NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " dedup_hash TEXT NOT NULL UNIQUE)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_listings_query ON listings(brand, model, year, fetched_at)")
+        self.stats = {"store_hits": 0, "store_misses": 0, "inserted": 0}
+
+    def append(self, brand: str, model: str, df: "pd.DataFrame", source: str) -> "pd.DataFrame":
+        """Guarda las publicaciones de una búsqueda. Devuelve las filas de `df` que eran nuevas."""
+        now = time.time()
+        rows = []
+        for year, price, km, model_detail in df[["year", "price", "km", "model_detail"]].itertuples(index=False):
+            year, price, km, model_detail = (_none_if_na(v) for v in (year, price, km, model_detail))
+            year, price, km = (None if v is None else int(v) for v in (year, price, km))
+            rows.append((brand, model, year, price, km, model_detail, source, now, now,
+                         _dedup_hash(source, brand, model, year, price, km, model_detail)))
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                # Fila por fila para saber cuáles eran nuevas (alimentan los modelos de precio)
+                nuevas = [
+                    i for i, row in enumerate(rows)
+                    if self._db.execute(
+                        "INSERT OR IGNORE INTO listings"
+                        " (brand, model, year, price, km, model_detail, source, first_seen, fetched_at, dedup_hash)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        row
+                    ).rowcount
+                ]
+                # Las ya conocidas siguen vigentes: se marcan como vistas ahora
+                self._db.executemany(
+                    "UPDATE listings SET fetched_at = ? WHERE dedup_hash = ?",
+                    [(now, row[-1]) for row in rows]
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+        self.stats["inserted"] += len(nuevas)
+        return df.iloc[nuevas]
+
+    def comparables(self, brand: str, model: str, year: int) -> "pd.DataFrame":
+        """Publicaciones recientes (< max_age) de la marca/modelo/año."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT year, price, km, brand, model, model_detail FROM listings"
+                " WHERE brand = ? AND model = ? AND year = ? AND fetched_at >= ?",
+                (brand, model, year, time.time() - self.max_age)
+            ).fetchall()
+
+        df = pandas().DataFrame.from_records(rows, columns=COLUMNS)
+        return df.astype({"year": "Int64", "price": "Int64", "km": "Int64", "model_detail": "string"})
+
+    def last_fetched(self, brand: str, model: str, year: int):
+        """Última vez (epoch) que se vio alguna publicación de la marca/modelo/año, o None."""
+        with self._lock:
+            (last,) = self._db.execute(
+                "SELECT MAX(fetched_at) FROM listings WHERE brand = ? AND model = ? AND year = ?",
+                (brand, model, year)
+            ).fetchone()
+        return last
+
+    def aggregate_stats(self, min_price: float = 1e6) -> list:
+        """
+        Estadísticas suficientes de precio ~ km por (marca, modelo, año) sobre
+        todo el historial: (brand, model, year, n, Σx, Σy, Σxy, Σx², Σy², min precio).
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT brand, model, year, COUNT(*),"
+                " SUM(km * 1.0), SUM(price * 1.0), SUM(km * 1.0 * price), SUM(km * 1.0 * km),"
+                " SUM(price * 1.0 * price), MIN(price)"
+                " FROM listings WHERE price > ? AND km IS NOT NULL AND year IS NOT NULL"
+                " GROUP BY brand, model, year",
+                (min_price,)
+            ).fetchall()
+
+    def has_coverage(self, df: "pd.DataFrame") -> bool:
+        """True si hay suficientes comparables utilizables (mismo filtro de precio que la valuación)."""
+        covered = int((df.price.notna() & (df.price > 1e6)).sum()) >= self.min_comparables
+        self.stats["store_hits" if covered else "store_misses"] += 1
+        return covered
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+listings_store = ListingsStore()
@@ -1,14 +1,86 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, UploadFile, File, Header
+from fastapi.responses import StreamingResponse, Response, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List
+from contextlib import asynccontextmanager
 import asyncio
 import uuid
+import os
+import io
+import csv
+import json
 
-from scrap_pipeline import scrap_pipeline_async
-from get_info_by_patente import get_info_by_patente
+from scrap_pipeline import scrap_pipeline_async, listing_flight, collection_stats, source_stats
+from get_google_info import close_client as close_google_client
+import get_ml_info
+from listing_cache import listing_cache, normalizar_query
+from listings_store import listings_store
+from pricing import LinearPriceModel
+from price_models import price_models
+from get_info_by_patente import get_info_by_patente_async, patente_flight, LOOKUP_MODE as PATENTE_LOOKUP_MODE
+from driver_pool import driver_pool
+from patente_cache import patente_cache
+from stages import run_stage, admission, OverloadedError
+from quota import quota, QuotaExceededError
+import circuit_breaker
+from circuit_breaker import CircuitOpenError
+from prewarm import prewarm, PREWARM_ENABLED
+from progress_bus import progress_bus
+from ws_connections import connections
+from jobs import job_manager
+import metrics
+from metrics import medir_etapa, VALUACIONES
+import profiling
+import warmup
+import stages
 
-app = FastAPI(title="Car Valuation API", version="1.0.0")
+# Con la consulta HTTP el navegador es solo respaldo: se abre al primer uso en vez de al arrancar
+PATENTE_POOL_WARM = os.getenv("PATENTE_POOL_WARM", "1" if PATENTE_LOOKUP_MODE == "browser" else "0") == "1"
+LOTE_MAX_ITEMS = int(os.getenv("LOTE_MAX_ITEMS", "1000"))
+LOTE_CONCURRENCIA = int(os.getenv("LOTE_CONCURRENCIA", "4"))
+# Consultas de patente simultáneas de todos los lotes: por debajo del límite de la etapa,
+# para que las valuaciones interactivas siempre encuentren un navegador libre
+LOTE_CONCURRENCIA_PATENTES = int(os.getenv("LOTE_CONCURRENCIA_PATENTES",
+                                           str(max(1, stages.STAGE_LIMITS["patente"] - 1))))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if warmup.WARMUP_ENABLED:
+        # pandas, httpx, Selenium... se cargan en segundo plano con el servidor ya aceptando tráfico
+        asyncio.get_running_loop().run_in_executor(None, warmup.warm_pipeline)
+    if PATENTE_POOL_WARM:
+        # Precalentar los navegadores en segundo plano, sin retrasar el arranque
+        asyncio.get_running_loop().run_in_executor(None, driver_pool.warm)
+    if get_ml_info.disponible():
+        # El navegador compartido de MercadoLibre parte en segundo plano
+        ml_start = asyncio.create_task(get_ml_info.start_crawler())
+    else:
+        print(f"MercadoLibre desactivado, solo se buscan publicaciones en Google: {get_ml_info.motivo_desactivado()}")
+    await progress_bus.start()
+    if len(price_models) == 0:
+        # Primera vez: los modelos de precio parten del historial que ya tiene el store
+        await run_stage("store", lambda: price_models.seed(listings_store.aggregate_stats()))
+    job_manager.start()
+    if PREWARM_ENABLED:
+        prewarm.start()
+    yield
+    await prewarm.stop()
+    await job_manager.stop()
+    await progress_bus.stop()
+    await asyncio.to_thread(driver_pool.close)
+    patente_cache.close()
+    listings_store.close()
+    price_models.close()
+    quota.close()
+    job_manager.close()
+    await close_google_client()
+    if get_ml_info.disponible():
+        await ml_start
+        await get_ml_info.close_crawler()
+    stages.shutdown()
+
+app = FastAPI(title="Car Valuation API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,9 +92,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Almacenar conexiones WebSocket activas
-websocket_connections: Dict[str, WebSocket] = {}
-
 class VehicleData(BaseModel):
     brand: str
     model: str
@@ -67,28 +136,28 @@ class ProgressMessage(BaseModel):
     percentage: float
     session_id: str
 
-# Función para enviar progreso
+# Función para enviar progreso: se publica en el bus y lo entrega el worker que tiene el WebSocket
 async def send_progress(session_id: str, step: int, total_steps: int, message: str):
-    if session_id in websocket_connections:
-        percentage = (step / total_steps) * 100
-        progress_msg = ProgressMessage(
-            step=step,
-            total_steps=total_steps,
-            message=message,
-            percentage=percentage,
-            session_id=session_id
-        )
-        try:
-            await websocket_connections[session_id].send_text(progress_msg.json())
-        except:
-            # Si falla el envío, remover la conexión
-            if session_id in websocket_connections:
-                del websocket_connections[session_id]
+    percentage = (step / total_steps) * 100
+    progress_msg = ProgressMessage(
+        step=step,
+        total_steps=total_steps,
+        message=message,
+        percentage=percentage,
+        session_id=session_id
+    )
+    await progress_bus.publish(session_id, progress_msg.model_dump_json())
+
+async def pausa(segundos: float):
+    # Pausas deliberadas entre pasos de progreso: se miden aparte para no confundirlas con trabajo real
+    with medir_etapa("pausa"):
+        await asyncio.sleep(segundos)
 
-async def get_base_df_price_async(patente: Optional[str], vehicle_data: Optional[VehicleData], session_id: str, global_step_offset: int = 0, global_total_steps: int = 8) -> float:
+async def get_base_df_price_async(patente: Optional[str], vehicle_data: Optional[VehicleData], session_id: str, global_step_offset: int = 0, global_total_steps: int = 8):
     """
     Función async con steps de progreso global unificado.
-    Funciona con patente o datos del vehículo.
+    Funciona con patente o datos del vehículo. Devuelve los comparables y
+    la consulta (marca, modelo, año) normalizada.
     Reemplaza con tu lógica de tasación real manteniendo la estructura de progreso.
     
     Args:
@@ -101,24 +170,24 @@ async def get_base_df_price_async(patente: Optional[str], vehicle_data: Optional
     
     if patente:
         await send_progress(session_id, global_step_offset + 1, global_total_steps, "Validando patente...")
-        await asyncio.sleep(1)
+        await pausa(1)
         
         await send_progress(session_id, global_step_offset + 2, global_total_steps, "Consultando base de datos por patente...")
-        await asyncio.sleep(1)
+        await pausa(1)
         
         print('here 1')
-        vehicle_data = get_info_by_patente(patente)
+        prewarm.record_patente(patente)
+        with medir_etapa("patente"):
+            vehicle_data = await get_info_by_patente_async(patente)
         print(vehicle_data)
-        brand = vehicle_data["Marca"].lower()
-        model = vehicle_data["Modelo"].lower()
-        year = int(vehicle_data["Año"])
+        brand, model, year = vehiculo_desde_patente(vehicle_data)
         
     else:  # vehicle_data
         await send_progress(session_id, global_step_offset + 1, global_total_steps, "Validando datos del vehículo...")
-        await asyncio.sleep(1)
+        await pausa(1)
         
         await send_progress(session_id, global_step_offset + 2, global_total_steps, f"Consultando precios para {vehicle_data.brand} {vehicle_data.model}...")
-        await asyncio.sleep(1)
+        await pausa(1)
         
         # Simulación de precios base según datos del vehículo
         brand = vehicle_data.brand.lower()
@@ -126,13 +195,94 @@ async def get_base_df_price_async(patente: Optional[str], vehicle_data: Optional
         year = vehicle_data.year
 
     await send_progress(session_id, global_step_offset + 3, global_total_steps, "Consultando base de datos por patente...")  
-    df = scrap_pipeline_async(brand, model, year)
-    df = df[(df.price.notna()) & (df.year==year) & (df.price>1e6)].drop_duplicates()
+    prewarm.record_query(brand, model, year)
+    with medir_etapa("publicaciones"):
+        df = await scrap_pipeline_async(brand, model, year)
+    with medir_etapa("comparables"):
+        df = await run_stage("pandas", filtrar_comparables, df, year)
     print(df)
 
-    return df
+    return df, normalizar_query(brand, model, year)
+
+def vehiculo_desde_patente(datos: dict):
+    if not datos:
+        raise ValueError("Patente no encontrada")
+    return datos["Marca"].lower(), datos["Modelo"].lower(), int(datos["Año"])
+
+def filtrar_comparables(df, year: int):
+    return df[(df.price.notna()) & (df.year==year) & (df.price>1e6)].drop_duplicates()
+
+def filtrar_datos_km(df):
+    return df[(df.km.notna()) & (df.price.notna())].copy()
+
+def modelo_de_precio(valid_data, consulta: Optional[tuple]):
+    """
+    Modelo precio ~ km para `consulta` (marca, modelo, año normalizados):
+    el acumulado del registro si tiene suficientes publicaciones (O(1),
+    aunque no haya comparables frescos); si no, o sin `consulta`, ajuste
+    sobre las filas recibidas. None si tampoco alcanzan (< 3 filas).
+    """
+    model = price_models.get(consulta) if consulta is not None else None
+    if model is None and len(valid_data) >= 3:
+        model = LinearPriceModel.fit(valid_data['km'], valid_data['price'])
+    return model
+
+def precio_por_regresion(valid_data, kilometers: int, model: Optional[LinearPriceModel] = None) -> float:
+    # Regresión precio ~ km en forma cerrada
+    if model is None:
+        model = LinearPriceModel.fit(valid_data['km'], valid_data['price'])
+
+    # Predecir precio basado en kilometraje
+    predicted_price = float(model.predict(kilometers))
+    
+    # Asegurar que el precio no sea negativo
+    return max(predicted_price, model.min_price)
+
+def estimar_precio(df_comparables, kilometers: Optional[int], consulta: Optional[tuple]):
+    """
+    Versión sin progreso del cálculo de precio (misma lógica que el flujo
+    con progreso). Devuelve (precio estimado, mensaje).
+    """
+    if not kilometers:
+        price = df_comparables['price'].mean() if len(df_comparables) > 0 else 10000000
+        return price, "Precio base (sin ajuste por kilometraje)"
+
+    _, price = precio_por_kilometraje(filtrar_datos_km(df_comparables), kilometers, consulta)
+    return price, f"Precio ajustado por kilometraje ({kilometers:,} km)"
+
+def precio_por_kilometraje(valid_data, kilometers: int, consulta: Optional[tuple]):
+    """
+    (modelo, precio ajustado por kilometraje): por regresión si hay modelo,
+    si no con el método estándar sobre el precio medio (modelo None).
+    """
+    model = modelo_de_precio(valid_data, consulta)
+    if model is None:
+        base_price = valid_data['price'].mean() if len(valid_data) > 0 else 10000000
+        return None, ajust_price_by_kilometers_deprecation(base_price, kilometers)
+    return model, precio_por_regresion(valid_data, kilometers, model)
+
+def precio_de_compra(precio_estimado: float) -> float:
+    # Ajuste toma vehiculo
+    return precio_estimado - (0.1 * precio_estimado + 1e6)
+
+def respuesta_valuacion(request: "ValuationRequest", session_id: str, estimed_price: float, message: str) -> "ValuationResponse":
+    # Determinar qué información mostrar en la respuesta
+    response_data = {
+        "precio_estimado": estimed_price,
+        "precio_compra": precio_de_compra(estimed_price),
+        "kilometers": request.kilometers,
+        "message": message,
+        "session_id": session_id
+    }
+    
+    if request.patente:
+        response_data["patente"] = request.patente.upper()
+    else:
+        response_data["vehicle_data"] = request.vehicle_data
+    
+    return ValuationResponse(**response_data)
 
-async def ajust_price_by_kilometers_deprecation_async(df_base_price, kilometers: int, session_id: str, global_step_offset: int = 5, global_total_steps: int = 8) -> float:
+async def ajust_price_by_kilometers_deprecation_async(df_base_price, kilometers: int, session_id: str, global_step_offset: int = 5, global_total_steps: int = 8, consulta: Optional[tuple] = None) -> float:
     """
     Función async con regresión lineal para ajuste por kilometraje basado en datos reales.
     
@@ -142,48 +292,27 @@ async def ajust_price_by_kilometers_deprecation_async(df_base_price, kilometers:
         session_id: ID de sesión para WebSocket
         global_step_offset: Offset para el progreso global
         global_total_steps: Total de steps en todo el proceso
+        consulta: (marca, modelo, año) normalizados, para el modelo acumulado; sin ella se ajusta sobre df_base_price
     """
-    from sklearn.linear_model import LinearRegression
-    
     await send_progress(session_id, global_step_offset + 1, global_total_steps, "Analizando datos de kilometraje...")
-    await asyncio.sleep(1)
+    await pausa(1)
     
     # Filtrar datos válidos
-    valid_data = df_base_price[(df_base_price.km.notna()) & (df_base_price.price.notna())].copy()
+    with medir_etapa("filtro_km"):
+        valid_data = await run_stage("pandas", filtrar_datos_km, df_base_price)
+    # Modelo y predicción en una sola etapa: una observación de "regresion" por valuación
+    with medir_etapa("regresion"):
+        model, final_price = await run_stage("pandas", precio_por_kilometraje, valid_data, kilometers, consulta)
     
-    if len(valid_data) < 3:
+    if model is None:
         # Si no hay suficientes datos, usar método tradicional
         await send_progress(session_id, global_step_offset + 2, global_total_steps, "Pocos datos disponibles, usando método estándar...")
-        base_price = valid_data['price'].mean() if len(valid_data) > 0 else 10000000
-        
-        if kilometers <= 50000:
-            final_price = base_price
-        elif kilometers <= 100000:
-            final_price = base_price * 0.9
-        elif kilometers <= 150000:
-            final_price = base_price * 0.8
-        else:
-            final_price = base_price * 0.7
     else:
         await send_progress(session_id, global_step_offset + 2, global_total_steps, "Entrenando modelo de regresión...")
-        await asyncio.sleep(1)
-        
-        # Preparar datos para regresión
-        X = valid_data[['km']].values
-        y = valid_data['price'].values
-        
-        # Entrenar modelo
-        model = LinearRegression()
-        model.fit(X, y)
-        
-        # Predecir precio basado en kilometraje
-        predicted_price = model.predict([[kilometers]])[0]
-        
-        # Asegurar que el precio no sea negativo
-        final_price = max(predicted_price, valid_data['price'].min())
+        await pausa(1)
     
     await send_progress(session_id, global_step_offset + 3, global_total_steps, "Ajuste por kilometraje completado")
-    await asyncio.sleep(0.5)
+    await pausa(0.5)
     
     return final_price
 
@@ -249,16 +378,8 @@ def ajust_price_by_year_deprecation(base_price, year, percent=5):
 
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    await websocket.accept()
-    websocket_connections[session_id] = websocket
-    
-    try:
-        while True:
-            # Mantener conexión viva
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        if session_id in websocket_connections:
-            del websocket_connections[session_id]
+    # Cola de envío propia por cliente: un socket lento no frena la valuación
+    await connections.serve(websocket, session_id)
 
 @app.get("/")
 def read_root():
@@ -298,69 +419,305 @@ def valuar_vehiculo(request: ValuationRequest):
         raise HTTPException(status_code=400, detail=f"Error al valuar vehículo: {str(e)}")
 
 @app.post("/valuar-con-progreso", response_model=ValuationResponse)
-async def valuar_vehiculo_con_progreso(request: ValuationRequest):
-    def custom_func(x: float) -> float:
-        return 0.1 * x + 1e6
+async def valuar_vehiculo_con_progreso(request: ValuationRequest, response: Response,
+                                       x_profile_token: Optional[str] = Header(None)):
+    if x_profile_token is None:
+        return await _valuar_admitido(request)
+
+    # Perfilado a pedido: solo con el token de administración configurado en PROFILING_TOKEN
+    if not profiling.autorizado(x_profile_token):
+        raise HTTPException(status_code=403, detail="Token de perfilado inválido")
     try:
-        session_id = request.session_id or str(uuid.uuid4())
-        
-        # Definir el total de steps global para todo el proceso
-        total_global_steps = 10 if request.kilometers else 7
-        
-        # Usar las funciones async con progreso global unificado
-        # Precio base: steps 1-5 (offset 0)
-        df_base_price = await get_base_df_price_async(
-            request.patente, 
-            request.vehicle_data,
-            session_id, 
-            global_step_offset=0, 
-            global_total_steps=total_global_steps
+        async with profiling.perfilar() as perfil_id:
+            response.headers["X-Profile-Id"] = perfil_id
+            try:
+                return await _valuar_admitido(request)
+            except HTTPException as e:
+                # También las valuaciones fallidas dejan su perfil
+                e.headers = {**(e.headers or {}), "X-Profile-Id": perfil_id}
+                raise
+    except profiling.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+def clasificar_error(e: Exception):
+    """(código HTTP, resultado para las métricas, detalle, Retry-After o None) de una valuación fallida."""
+    if isinstance(e, QuotaExceededError):
+        # Sin cuota y sin publicaciones guardadas: mejor un 503 claro que un precio inventado
+        return 503, "sin_cuota", str(e), e.retry_after
+    if isinstance(e, CircuitOpenError):
+        # Upstream caído y nada en cache: se falla al instante en vez de esperar timeouts
+        return 503, "upstream_caido", str(e), e.retry_after
+    if isinstance(e, OverloadedError):
+        return 503, "rechazada", str(e), 5
+    return 400, "error", f"Error al valuar vehículo: {str(e)}", None
+
+async def _valuar_admitido(request: ValuationRequest) -> ValuationResponse:
+    try:
+        # Limitar valuaciones simultáneas: sobre capacidad se encolan o se rechazan
+        async with admission.slot():
+            response = await _valuar_con_progreso(request)
+    except Exception as e:
+        status, resultado, detail, retry_after = clasificar_error(e)
+        VALUACIONES.inc(endpoint="valuar-con-progreso", resultado=resultado)
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+        raise HTTPException(status_code=status, detail=detail, headers=headers)
+    VALUACIONES.inc(endpoint="valuar-con-progreso", resultado="ok")
+    return response
+
+async def _valuar_con_progreso(request: ValuationRequest) -> ValuationResponse:
+    session_id = request.session_id or str(uuid.uuid4())
+    
+    # Definir el total de steps global para todo el proceso
+    total_global_steps = 10 if request.kilometers else 7
+    
+    # Usar las funciones async con progreso global unificado
+    # Precio base: steps 1-5 (offset 0)
+    df_base_price, consulta = await get_base_df_price_async(
+        request.patente, 
+        request.vehicle_data,
+        session_id, 
+        global_step_offset=0, 
+        global_total_steps=total_global_steps
+    )
+    
+    if request.kilometers:
+        # Ajuste por kilometraje: steps 6-8 (offset 5)
+        estimed_price = await ajust_price_by_kilometers_deprecation_async(
+            df_base_price, 
+            request.kilometers, 
+            session_id,
+            global_step_offset=5,
+            global_total_steps=total_global_steps,
+            consulta=consulta
         )
-        
-        if request.kilometers:
-            # Ajuste por kilometraje: steps 6-8 (offset 5)
-            estimed_price = await ajust_price_by_kilometers_deprecation_async(
-                df_base_price, 
-                request.kilometers, 
-                session_id,
-                global_step_offset=5,
-                global_total_steps=total_global_steps
-            )
-            message = f"Precio ajustado por kilometraje ({request.kilometers:,} km)"
-        else:
-            estimed_price = df_base_price['price'].mean() if len(df_base_price) > 0 else 10000000
-            message = "Precio base (sin ajuste por kilometraje)"
+        message = f"Precio ajustado por kilometraje ({request.kilometers:,} km)"
+    else:
+        estimed_price = df_base_price['price'].mean() if len(df_base_price) > 0 else 10000000
+        message = "Precio base (sin ajuste por kilometraje)"
 
-        # Enviar progreso final
-        await send_progress(session_id, total_global_steps-1, total_global_steps, "Ajuste toma vehiculo")
-        final_price = estimed_price - custom_func(estimed_price)
-        
-        # Enviar progreso final
-        await send_progress(session_id, total_global_steps, total_global_steps, "¡Tasación completada!")
-        
-        # Determinar qué información mostrar en la respuesta
-        response_data = {
-            "precio_estimado": estimed_price,
-            "precio_compra": final_price,
-            "kilometers": request.kilometers,
-            "message": message,
-            "session_id": session_id
-        }
-        
-        if request.patente:
-            response_data["patente"] = request.patente.upper()
-        else:
-            response_data["vehicle_data"] = request.vehicle_data
-        
-        return ValuationResponse(**response_data)
+    # Enviar progreso final
+    await send_progress(session_id, total_global_steps-1, total_global_steps, "Ajuste toma vehiculo")
+    response = respuesta_valuacion(request, session_id, estimed_price, message)
     
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error al valuar vehículo: {str(e)}")
+    # Enviar progreso final
+    await send_progress(session_id, total_global_steps, total_global_steps, "¡Tasación completada!")
+    
+    return response
+
+async def _valuar_trabajo(payload: dict, session_id: str) -> ValuationResponse:
+    # El trabajo llega desde la tabla de trabajos como JSON
+    return await _valuar_con_progreso(ValuationRequest(**{**payload, "session_id": session_id}))
+
+job_manager.runner = _valuar_trabajo
+
+@app.post("/trabajos", status_code=202)
+async def crear_trabajo(request: ValuationRequest, prioridad: int = 0):
+    """Encola la valuación y responde de inmediato; el progreso sigue llegando por /ws/{session_id}."""
+    try:
+        job = job_manager.submit(request, request.session_id, prioridad)
+    except OverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return {"job_id": job.job_id, "session_id": job.session_id, "estado": job.estado}
+
+@app.get("/trabajos/{job_id}")
+async def consultar_trabajo(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return job.as_dict()
+
+@app.delete("/trabajos/{job_id}")
+async def cancelar_trabajo(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return job.as_dict()
+
+_patentes_lote = None
+
+def _semaforo_patentes_lote() -> asyncio.Semaphore:
+    global _patentes_lote
+    if _patentes_lote is None:
+        _patentes_lote = asyncio.Semaphore(LOTE_CONCURRENCIA_PATENTES)
+    return _patentes_lote
+
+class _GruposLote:
+    """
+    Comparables compartidos dentro de un lote: una búsqueda por
+    (marca, modelo, año), con a lo más `concurrencia` búsquedas a la vez.
+    Cada búsqueda y cada consulta de patente pasan por el mismo control de
+    admisión que una valuación individual: un lote grande espera su turno
+    (o se rechaza) en vez de dejar sin capacidad a las valuaciones interactivas.
+    """
+
+    def __init__(self, concurrencia: int):
+        self._semaphore = asyncio.Semaphore(concurrencia)
+        self._tasks = {}
+
+    def comparables(self, brand: str, model: str, year: int):
+        key = normalizar_query(brand, model, year)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.ensure_future(self._buscar(brand, model, year))
+        return self._tasks[key]
+
+    async def _buscar(self, brand: str, model: str, year: int):
+        async with self._semaphore, admission.slot():
+            df = await scrap_pipeline_async(brand, model, year)
+            return await run_stage("pandas", filtrar_comparables, df, year)
+
+    async def vehiculo(self, patente: str):
+        # Los lotes comparten LOTE_CONCURRENCIA_PATENTES navegadores; el resto queda para /valuar
+        async with _semaforo_patentes_lote(), admission.slot():
+            return vehiculo_desde_patente(await get_info_by_patente_async(patente))
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+async def _valuar_fila_lote(request: ValuationRequest, session_id: str, grupos: _GruposLote) -> ValuationResponse:
+    if request.patente:
+        prewarm.record_patente(request.patente)
+        brand, model, year = await grupos.vehiculo(request.patente)
+    else:
+        brand = request.vehicle_data.brand.lower()
+        model = request.vehicle_data.model.lower()
+        year = request.vehicle_data.year
+    prewarm.record_query(brand, model, year)
+
+    df = await grupos.comparables(brand, model, year)
+    estimed_price, message = await run_stage("pandas", estimar_precio, df, request.kilometers,
+                                             normalizar_query(brand, model, year))
+    return respuesta_valuacion(request, session_id, estimed_price, message)
+
+async def _stream_lote(requests: List[ValuationRequest]):
+    """Genera una línea NDJSON por vehículo, en el orden en que se terminan."""
+    lote_id = uuid.uuid4().hex[:8]
+    grupos = _GruposLote(LOTE_CONCURRENCIA)
+    resultados = asyncio.Queue()
+
+    async def valuar(i: int, request: ValuationRequest):
+        session_id = request.session_id or f"lote-{lote_id}-{i}"
+        try:
+            response = await _valuar_fila_lote(request, session_id, grupos)
+            line = response.model_dump_json()
+            VALUACIONES.inc(endpoint="valuar-lote", resultado="ok")
+        except Exception as e:
+            status, resultado, detail, retry_after = clasificar_error(e)
+            VALUACIONES.inc(endpoint="valuar-lote", resultado=resultado)
+            error = {"session_id": session_id, "error": detail, "status": status}
+            if retry_after is not None:
+                error["retry_after"] = retry_after
+            line = json.dumps(error)
+        await resultados.put(line)
+
+    tasks = [asyncio.create_task(valuar(i, request)) for i, request in enumerate(requests)]
+    try:
+        for _ in tasks:
+            yield await resultados.get() + "\n"
+    finally:
+        # Cliente desconectado o lote terminado: no dejar trabajo colgando
+        for task in tasks:
+            task.cancel()
+        grupos.cancel()
+
+def _leer_csv_lote(contenido: str) -> List[ValuationRequest]:
+    """CSV con columnas `patente` o `brand,model,year[,version]`, y opcionalmente `kilometers`."""
+    requests = []
+    for n, row in enumerate(csv.DictReader(io.StringIO(contenido)), start=2):
+        row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+        try:
+            kilometers = int(row["kilometers"]) if row.get("kilometers") else None
+            if row.get("patente"):
+                requests.append(ValuationRequest(patente=row["patente"], kilometers=kilometers))
+            else:
+                vehicle_data = VehicleData(
+                    brand=row.get("brand", ""),
+                    model=row.get("model", ""),
+                    year=row.get("year"),
+                    version=row.get("version") or None
+                )
+                requests.append(ValuationRequest(vehicle_data=vehicle_data, kilometers=kilometers))
+        except ValueError as e:
+            raise ValueError(f"Fila {n}: {e}")
+    return requests
+
+def _respuesta_lote(requests: List[ValuationRequest]) -> StreamingResponse:
+    if not requests:
+        raise HTTPException(status_code=400, detail="El lote está vacío")
+    if len(requests) > LOTE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"El lote supera el máximo de {LOTE_MAX_ITEMS} vehículos")
+    return StreamingResponse(_stream_lote(requests), media_type="application/x-ndjson")
+
+@app.post("/valuar-lote")
+async def valuar_lote(requests: List[ValuationRequest]):
+    return _respuesta_lote(requests)
+
+@app.post("/valuar-lote-csv")
+async def valuar_lote_csv(archivo: UploadFile = File(...)):
+    try:
+        requests = _leer_csv_lote((await archivo.read()).decode("utf-8-sig"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"CSV inválido: {str(e)}")
+    return _respuesta_lote(requests)
 
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
+metrics.Gauge("websockets_abiertos", "Conexiones WebSocket de progreso abiertas en este worker",
+              connections.abiertas)
+metrics.Gauge("valuaciones_en_curso", "Valuaciones ejecutándose ahora",
+              lambda: {"sincrono": admission.en_curso, "trabajos": job_manager.en_curso()}, labels=("origen",))
+metrics.Gauge("valuaciones_en_cola", "Valuaciones esperando turno",
+              lambda: {"sincrono": admission.en_cola, "trabajos": job_manager.pendientes()}, labels=("origen",))
+metrics.Gauge("circuito_estado", "Estado del circuit breaker por upstream (0 cerrado, 1 semiabierto, 2 abierto)",
+              lambda: {name: circuit_breaker.ESTADOS[b.estado()] for name, b in circuit_breaker.BREAKERS.items()},
+              labels=("upstream",))
+metrics.Gauge("google_cuota_diaria_restante", "Consultas a Google Custom Search que quedan hoy (todos los workers)",
+              quota.remaining_today)
+
+@app.get("/metrics")
+def metricas():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/cuota")
+def cuota():
+    """Cuota restante de la API de Google, compartida por todos los workers."""
+    return quota.report()
+
+@app.get("/perfiles/{perfil_id}")
+def obtener_perfil(perfil_id: str, formato: str = "resumen", x_profile_token: str = Header(...)):
+    """`formato=resumen` (JSON con stacks y asignaciones principales) o `formato=collapsed` (para flamegraphs)."""
+    if not profiling.autorizado(x_profile_token):
+        raise HTTPException(status_code=403, detail="Token de perfilado inválido")
+    archivos = {"resumen": ("resumen.json", "application/json"), "collapsed": ("cpu.collapsed", "text/plain")}
+    if formato not in archivos:
+        raise HTTPException(status_code=400, detail="Formato debe ser 'resumen' o 'collapsed'")
+    archivo, media_type = archivos[formato]
+    ruta = profiling.ruta_perfil(perfil_id, archivo)
+    if ruta is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return FileResponse(ruta, media_type=media_type)
+
+@app.get("/estadisticas")
+def estadisticas():
+    return {
+        "patente_cache": patente_cache.stats,
+        "listing_cache": listing_cache.stats,
+        "listings_store": listings_store.stats,
+        "modelos_precio": {**price_models.stats, "modelos": len(price_models)},
+        "recoleccion": {**collection_stats, "fuentes": source_stats,
+                        "mercadolibre_desactivado": get_ml_info.motivo_desactivado()},
+        "circuitos": circuit_breaker.report(),
+        "coalescing": {"patentes": patente_flight.stats, "publicaciones": listing_flight.stats},
+        "driver_pool": driver_pool.stats(),
+        "valuaciones": {"en_curso": admission.en_curso, "en_cola": admission.en_cola},
+        "websockets": connections.report(),
+        "trabajos": {**job_manager.stats, "en_cola": job_manager.pendientes(), "en_curso": job_manager.en_curso()},
+        "arranque": warmup.report(),
+        "precalentamiento": {**prewarm.stats, "presupuesto_restante": prewarm.budget()},
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
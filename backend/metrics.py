@@ -0,0 +1,174 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Buckets en segundos: desde el parseo (ms) hasta el scraping con navegador (decenas de segundos)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    tipo = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.tipo}"]
+
+
+class Counter(_Metric):
+    tipo = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.labels, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    tipo = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [conteos por bucket..., suma, total]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = self.header()
+        names = self.labels + ("le",)
+        for key, data in items:
+            acumulado = 0
+            for bound, count in zip(self.buckets, data):
+                acumulado += count
+                lines.append(f"{self.name}_bucket{_labels_text(names, key + (bound,))} {acumulado}")
+            lines.append(f"{self.name}_bucket{_labels_text(names, key + ('+Inf',))} {data[-1]}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {data[-2]}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {data[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge que se lee al momento de exportar: `func()` devuelve el valor o un dict {valor de etiqueta: valor}."""
+    tipo = "gauge"
+
+    def __init__(self, name: str, help: str, func, labels=()):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def render(self) -> list:
+        value = self.func()
+        if isinstance(value, dict):
+            return self.header() + [f"{self.name}{_labels_text(self.labels, (k,))} {v}" for k, v in value.items()]
+        return self.header() + [f"{self.name} {value}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"Error exportando métrica {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = Histogram(
+    "valuacion_etapa_segundos",
+    "Duración de cada etapa de la valuación",
+    labels=("etapa",),
+)
+VALUACIONES = Counter(
+    "valuaciones_total",
+    "Valuaciones terminadas por endpoint y resultado",
+    labels=("endpoint", "resultado"),
+)
+UPSTREAM_SECONDS = Histogram(
+    "upstream_request_segundos",
+    "Duración de las llamadas a servicios externos",
+    labels=("upstream",),
+)
+UPSTREAM_REQUESTS = Counter(
+    "upstream_requests_total",
+    "Llamadas a servicios externos por resultado (ok, error, reintento, sin_cuota)",
+    labels=("upstream", "resultado"),
+)
+
+
+def medir_etapa(etapa: str):
+    """Context manager (sirve en código sync y async) que registra la duración de una etapa."""
+    return STAGE_SECONDS.time(etapa=etapa)
+
+
+@contextmanager
+def medir_upstream(upstream: str):
+    """Registra duración y resultado (ok/error) de una llamada a un servicio externo."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_REQUESTS.inc(upstream=upstream, resultado="error")
+        raise
+    else:
+        UPSTREAM_REQUESTS.inc(upstream=upstream, resultado="ok")
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, upstream=upstream)
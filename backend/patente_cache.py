@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+CACHE_PATH = os.getenv("PATENTE_CACHE_PATH", "patente_cache.sqlite3")
+CACHE_TTL = float(os.getenv("PATENTE_CACHE_TTL", str(30 * 24 * 3600)))
+NEGATIVE_TTL = float(os.getenv("PATENTE_CACHE_NEGATIVE_TTL", "3600"))
+MEMORY_SIZE = int(os.getenv("PATENTE_CACHE_MEMORY_SIZE", "1024"))
+MAX_ENTRIES = int(os.getenv("PATENTE_CACHE_MAX_ENTRIES", "100000"))
+
+
+def normalizar_patente(patente: str) -> str:
+    return "".join(c for c in patente.upper() if c.isalnum())
+
+
+class PatenteCache:
+    """
+    Cache de dos niveles patente -> datos del vehículo.
+
+    Nivel 1: LRU en memoria. Nivel 2: SQLite en disco, compartido entre
+    workers. Las patentes sin resultado se guardan como entrada negativa
+    (`{}`) con un TTL más corto.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: float = CACHE_TTL, negative_ttl: float = NEGATIVE_TTL,
+                 memory_size: int = MEMORY_SIZE, max_entries: int = MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self._memory = OrderedDict()  # patente -> (expires_at, datos)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS patentes ("
+            " patente TEXT PRIMARY KEY,"
+            " datos TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_patentes_created ON patentes(created_at)")
+        self._writes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, patente: str) -> Optional[dict]:
+        """Devuelve los datos cacheados, `{}` si la patente es conocida como inexistente o None si no hay entrada."""
+        key = normalizar_patente(patente)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._hit(entry[1])
+
+            row = self._db.execute(
+                "SELECT datos, expires_at FROM patentes WHERE patente = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self._memory.pop(key, None)
+                self.stats["misses"] += 1
+                return None
+
+            datos = json.loads(row[0])
+            self._remember(key, row[1], datos)
+            self.stats["disk_hits"] += 1
+            return self._hit(datos)
+
+    def set(self, patente: str, datos: dict):
+        key = normalizar_patente(patente)
+        now = time.time()
+        expires_at = now + (self.ttl if datos else self.negative_ttl)
+        with self._lock:
+            self._remember(key, expires_at, dict(datos))
+            self._db.execute(
+                "INSERT OR REPLACE INTO patentes (patente, datos, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(datos), now, expires_at)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict_disk(now)
+
+    def set_refreshed(self, patente: str, datos: dict) -> dict:
+        """
+        Guarda el resultado de un refresco por adelantado. Un resultado vacío
+        (consulta fallida o sin tabla) no reemplaza una entrada positiva: esa
+        se conserva y solo se extiende por `negative_ttl`, para reintentar
+        pronto. Devuelve los datos que quedaron en la cache.
+        """
+        if datos:
+            self.set(patente, datos)
+            return dict(datos)
+
+        key = normalizar_patente(patente)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT datos, expires_at FROM patentes WHERE patente = ? AND datos != '{}'", (key,)
+                ).fetchone()
+                if row is not None:
+                    expires_at = max(row[1], now + self.negative_ttl)
+                    self._db.execute("UPDATE patentes SET expires_at = ? WHERE patente = ?", (expires_at, key))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            if row is not None:
+                conservados = json.loads(row[0])
+                self._remember(key, expires_at, conservados)
+                return dict(conservados)
+        self.set(patente, datos)
+        return {}
+
+    def needs_refresh(self, patente: str, margin: float) -> bool:
+        """
+        True si la patente no está en disco o le queda menos de `margin` (fracción)
+        de su TTL. Las entradas negativas no se refrescan por adelantado.
+        """
+        key = normalizar_patente(patente)
+        with self._lock:
+            row = self._db.execute("SELECT datos, expires_at FROM patentes WHERE patente = ?", (key,)).fetchone()
+        if row is None:
+            return True
+        if row[0] == "{}":
+            return False
+        return row[1] - time.time() < self.ttl * margin
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _hit(self, datos: dict) -> dict:
+        if not datos:
+            self.stats["negative_hits"] += 1
+        # Copia para que el llamador no modifique la entrada cacheada
+        return dict(datos)
+
+    def _remember(self, key: str, expires_at: float, datos: dict):
+        self._memory[key] = (expires_at, datos)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self, now: float):
+        self._db.execute("DELETE FROM patentes WHERE expires_at <= ?", (now,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM patentes").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM patentes WHERE patente IN "
+                "(SELECT patente FROM patentes ORDER BY created_at LIMIT ?)", (overflow,)
+            )
+            self.stats["evictions"] += overflow
+
+
+patente_cache = PatenteCache()
@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+from collections import Counter, deque
+
+from listing_cache import listing_cache, normalizar_query
+from listings_store import listings_store
+from patente_cache import patente_cache, normalizar_patente
+from scrap_pipeline import refresh_listings
+from get_info_by_patente import refresh_patente_async
+from stages import run_stage
+from quota import QuotaExceededError
+
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") == "1"
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", "300"))
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "20"))
+# Fracción del TTL restante bajo la cual una entrada se refresca por adelantado
+PREWARM_MARGIN = float(os.getenv("PREWARM_MARGIN", "0.2"))
+PREWARM_API_CALLS_PER_HOUR = int(os.getenv("PREWARM_API_CALLS_PER_HOUR", "60"))
+PREWARM_BROWSER_SESSIONS_PER_HOUR = int(os.getenv("PREWARM_BROWSER_SESSIONS_PER_HOUR", "20"))
+# Cada ciclo las frecuencias se multiplican por este factor: pesan más las consultas recientes
+PREWARM_DECAY = float(os.getenv("PREWARM_DECAY", "0.5"))
+
+
+class _HourlyBudget:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._used = deque()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        while self._used and now - self._used[0] > 3600:
+            self._used.popleft()
+        if len(self._used) >= self.limit:
+            return False
+        self._used.append(now)
+        return True
+
+    def remaining(self) -> int:
+        now = time.monotonic()
+        return self.limit - sum(1 for t in self._used if now - t <= 3600)
+
+    def retry_after(self) -> float:
+        """Segundos hasta que se libere el token más antiguo."""
+        if not self._used:
+            return 0.0
+        return max(0.0, 3600 - (time.monotonic() - self._used[0]))
+
+
+class PrewarmScheduler:
+    """
+    Tarea de fondo que registra qué búsquedas y patentes se piden más y
+    refresca las top-N antes de que venzan, dentro de un presupuesto por
+    hora de llamadas a la API y de sesiones de navegador.
+    """
+
+    def __init__(self, interval: float = PREWARM_INTERVAL, top_n: int = PREWARM_TOP_N,
+                 api_calls_per_hour: int = PREWARM_API_CALLS_PER_HOUR,
+                 browser_sessions_per_hour: int = PREWARM_BROWSER_SESSIONS_PER_HOUR):
+        self.interval = interval
+        self.top_n = top_n
+        self._queries = Counter()
+        self._patentes = Counter()
+        self._api_budget = _HourlyBudget(api_calls_per_hour)
+        self._browser_budget = _HourlyBudget(browser_sessions_per_hour)
+        self._task = None
+        self.stats = {"runs": 0, "listing_refreshes": 0, "patente_refreshes": 0, "skipped_by_budget": 0, "errors": 0}
+
+    def record_query(self, brand: str, model: str, year: int):
+        self._queries[normalizar_query(brand, model, year)] += 1
+
+    def record_patente(self, patente: str):
+        self._patentes[normalizar_patente(patente)] += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def budget(self) -> dict:
+        return {"api_calls": self._api_budget.remaining(), "browser_sessions": self._browser_budget.remaining()}
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Error en precalentamiento: {e}")
+
+    async def run_once(self):
+        self.stats["runs"] += 1
+        queries = [key for key, _ in self._queries.most_common(self.top_n)]
+        patentes = [key for key, _ in self._patentes.most_common(self.top_n)]
+        self._decay()
+
+        for key in queries:
+            await self._refresh_query(*key)
+        for patente in patentes:
+            await self._refresh_patente(patente)
+
+    async def _refresh_query(self, brand: str, model: str, year: int):
+        key = (brand, model, year)
+
+        # ¿Los comparables del store están por vencer? Entonces hay que ir a Google
+        last = await run_stage("store", listings_store.last_fetched, brand, model, year)
+        force = last is None or time.time() - last > listings_store.max_age * (1 - PREWARM_MARGIN)
+
+        left = listing_cache.freshness_left(key)
+        if not force and left is not None and left > listing_cache.fresh_ttl * PREWARM_MARGIN:
+            return
+
+        # Con `force` seguro se llama a Google; sin él también, si el store no alcanza
+        if force and self._api_budget.remaining() <= 0:
+            self.stats["skipped_by_budget"] += 1
+            return
+
+        try:
+            # Cada intento contra Google (páginas y reintentos) toma un token del presupuesto
+            await refresh_listings(brand, model, year, force=force, presupuesto=self._api_budget)
+            self.stats["listing_refreshes"] += 1
+        except QuotaExceededError as e:
+            self.stats["skipped_by_budget"] += 1
+            print(f"Precalentamiento de {key} sin cuota: {e}")
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error precalentando {key}: {e}")
+
+    async def _refresh_patente(self, patente: str):
+        if not await run_stage("store", patente_cache.needs_refresh, patente, PREWARM_MARGIN):
+            return
+
+        if not self._browser_budget.take():
+            self.stats["skipped_by_budget"] += 1
+            return
+
+        try:
+            await refresh_patente_async(patente)
+            self.stats["patente_refreshes"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error precalentando patente {patente}: {e}")
+
+    def _decay(self):
+        for counter in (self._queries, self._patentes):
+            for key in list(counter):
+                counter[key] *= PREWARM_DECAY
+                if counter[key] < 0.01:
+                    del counter[key]
+
+
+prewarm = PrewarmScheduler()
@@ -0,0 +1,160 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import TYPE_CHECKING
+
+from pricing import LinearPriceModel
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PRICE_MODELS_PATH = os.getenv("PRICE_MODELS_PATH", "price_models.sqlite3")
+# Mínimo de publicaciones (efectivas) para confiar en el modelo acumulado
+PRICE_MODEL_MIN_N = float(os.getenv("PRICE_MODEL_MIN_N", "8"))
+# Vida media del peso de una publicación: el mercado se mueve y los datos viejos pesan menos
+PRICE_MODEL_HALF_LIFE = float(os.getenv("PRICE_MODEL_HALF_LIFE", str(90 * 24 * 3600)))
+
+# Mismo filtro de precio que los comparables de la valuación
+MIN_PRICE = 1e6
+
+_SUMAS = ("n", "sum_x", "sum_y", "sum_xy", "sum_xx", "sum_yy")
+
+
+class PriceModelRegistry:
+    """
+    Modelos precio ~ km por (marca, modelo, año) mantenidos en línea.
+
+    Por cada clave se guardan solo estadísticas suficientes (n, Σx, Σy,
+    Σxy, Σx², Σy²): cada publicación nueva se suma en O(1) y la predicción
+    no necesita las filas. Antes de sumar, lo acumulado se multiplica por
+    el factor de decaimiento según su antigüedad (vida media `half_life`).
+
+    La fuente de verdad es SQLite, compartida por todos los workers: cada
+    actualización lee, decae y suma la fila dentro de la misma transacción,
+    y en memoria solo quedan los modelos ya construidos, válidos mientras
+    la fila no cambie (`updated_at`).
+    """
+
+    def __init__(self, path: str = PRICE_MODELS_PATH, min_n: float = PRICE_MODEL_MIN_N,
+                 half_life: float = PRICE_MODEL_HALF_LIFE):
+        self.min_n = min_n
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS price_models ("
+            " brand TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " year INTEGER NOT NULL,"
+            " n REAL NOT NULL,"
+            " sum_x REAL NOT NULL,"
+            " sum_y REAL NOT NULL,"
+            " sum_xy REAL NOT NULL,"
+            " sum_xx REAL NOT NULL,"
+            " sum_yy REAL NOT NULL,"
+            " min_price REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (brand, model, year))"
+        )
+        # clave -> (updated_at de la fila, LinearPriceModel)
+        self._models = {}
+        self.stats = {"hits": 0, "misses": 0, "updates": 0}
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM price_models").fetchone()[0]
+
+    def _entry(self, key: tuple):
+        """[n, Σx, Σy, Σxy, Σx², Σy², min, updated_at] de la clave, o None."""
+        return self._db.execute(
+            "SELECT n, sum_x, sum_y, sum_xy, sum_xx, sum_yy, min_price, updated_at FROM price_models"
+            " WHERE brand = ? AND model = ? AND year = ?", key
+        ).fetchone()
+
+    def get(self, key: tuple):
+        """Modelo de la clave (O(1): una lectura por clave primaria), o None si no hay suficientes publicaciones."""
+        with self._lock:
+            entry = self._entry(key)
+            model = None
+            if entry is not None and entry[0] >= self.min_n:
+                cached = self._models.get(key)
+                if cached is not None and cached[0] == entry[7]:
+                    model = cached[1]
+                else:
+                    model = LinearPriceModel.from_stats(*entry[:7])
+                    self._models[key] = (entry[7], model)
+        self.stats["hits" if model is not None else "misses"] += 1
+        return model
+
+    def update(self, brand: str, model: str, df: "pd.DataFrame"):
+        """Suma publicaciones nuevas (una sola vez cada una) a los modelos de sus años."""
+        if df is None or len(df) == 0:
+            return
+        validas = df[df.price.notna() & df.km.notna() & df.year.notna() & (df.price > MIN_PRICE)]
+        if len(validas) == 0:
+            return
+
+        x = validas.km.astype(float)
+        y = validas.price.astype(float)
+        sumas = validas.assign(
+            year=validas.year.astype(int), n=1.0, sum_x=x, sum_y=y,
+            sum_xy=x * y, sum_xx=x * x, sum_yy=y * y, min_price=y,
+        ).groupby("year").agg({**{c: "sum" for c in _SUMAS}, "min_price": "min"})
+
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE: otro worker no puede intercalar su actualización entre la lectura y la escritura
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                claves = []
+                for year, fila in sumas.iterrows():
+                    key = (brand, model, int(year))
+                    entry = self._entry(key)
+                    if entry is None:
+                        entry = [0.0] * 6 + [fila.min_price, now]
+                    else:
+                        decay = 0.5 ** ((now - entry[7]) / self.half_life) if self.half_life > 0 else 1.0
+                        entry = [v * decay for v in entry[:6]] + [min(entry[6], fila.min_price), now]
+                    for i, col in enumerate(_SUMAS):
+                        entry[i] += float(fila[col])
+                    self._save(key, entry)
+                    claves.append(key)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            for key in claves:
+                self._models.pop(key, None)
+        self.stats["updates"] += len(sumas)
+
+    def seed(self, rows: list):
+        """Carga estadísticas ya agregadas (brand, model, year, n, Σx, Σy, Σxy, Σx², Σy², min) si no hay modelos."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Dentro de la transacción: si varios workers arrancan juntos, siembra uno solo
+                if self._db.execute("SELECT 1 FROM price_models LIMIT 1").fetchone() is None:
+                    for brand, model, year, *valores in rows:
+                        self._save((brand, model, int(year)), [float(v) for v in valores] + [now])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _save(self, key: tuple, entry: list):
+        self._db.execute(
+            "INSERT OR REPLACE INTO price_models"
+            " (brand, model, year, n, sum_x, sum_y, sum_xy, sum_xx, sum_yy, min_price, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*key, *entry)
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+price_models = PriceModelRegistry()
@@ -0,0 +1,87 @@
+import math
+
+from warmup import numpy
+
+
+class LinearPriceModel:
+    """
+    Regresión lineal precio ~ km por mínimos cuadrados en forma cerrada.
+
+    Reemplaza a sklearn.LinearRegression para el caso de una variable:
+    mismo resultado, sin importar sklearn ni crear objetos por request.
+    """
+
+    def __init__(self, intercept: float, slope: float, n: int, residual_std: float, r2: float, min_price: float):
+        self.intercept = intercept
+        self.slope = slope
+        self.n = n
+        self.residual_std = residual_std
+        self.r2 = r2
+        self.min_price = min_price
+
+    @classmethod
+    def fit(cls, km, price) -> "LinearPriceModel":
+        np = numpy()
+        x = np.asarray(km, dtype=float)
+        y = np.asarray(price, dtype=float)
+        n = x.size
+        if n == 0:
+            raise ValueError("Se necesita al menos un dato para ajustar el modelo")
+
+        x_mean = x.mean()
+        y_mean = y.mean()
+        dx = x - x_mean
+        dy = y - y_mean
+        sxx = dx @ dx
+
+        # Con todos los km iguales la pendiente queda en 0 (igual que sklearn)
+        slope = (dx @ dy) / sxx if sxx > 0 else 0.0
+        intercept = y_mean - slope * x_mean
+
+        residuals = dy - slope * dx
+        ss_res = residuals @ residuals
+        ss_tot = dy @ dy
+        residual_std = float(np.sqrt(ss_res / (n - 2))) if n > 2 else 0.0
+        r2 = float(1 - ss_res / ss_tot) if ss_tot > 0 else 0.0
+
+        return cls(float(intercept), float(slope), int(n), residual_std, r2, float(y.min()))
+
+    @classmethod
+    def from_stats(cls, n: float, sum_x: float, sum_y: float, sum_xy: float, sum_xx: float, sum_yy: float,
+                   min_price: float) -> "LinearPriceModel":
+        """
+        Mismo ajuste que `fit`, a partir de estadísticas suficientes
+        (n, Σx, Σy, Σxy, Σx², Σy²) en vez de los datos. `n` puede ser
+        fraccionario si las estadísticas se ponderan por antigüedad.
+        """
+        if n <= 0:
+            raise ValueError("Se necesita al menos un dato para ajustar el modelo")
+
+        x_mean = sum_x / n
+        y_mean = sum_y / n
+        sxx = max(sum_xx - sum_x * x_mean, 0.0)
+        sxy = sum_xy - sum_x * y_mean
+        syy = max(sum_yy - sum_y * y_mean, 0.0)
+
+        slope = sxy / sxx if sxx > 0 else 0.0
+        intercept = y_mean - slope * x_mean
+
+        ss_res = max(syy - slope * sxy, 0.0)
+        residual_std = math.sqrt(ss_res / (n - 2)) if n > 2 else 0.0
+        r2 = float(1 - ss_res / syy) if syy > 0 else 0.0
+
+        return cls(float(intercept), float(slope), int(round(n)), residual_std, r2, float(min_price))
+
+    def predict(self, km):
+        """Acepta un kilometraje o un arreglo de kilometrajes (predicción vectorizada)."""
+        return self.intercept + self.slope * numpy().asarray(km, dtype=float)
+
+    def as_dict(self) -> dict:
+        return {
+            "intercept": self.intercept,
+            "slope": self.slope,
+            "n": self.n,
+            "residual_std": self.residual_std,
+            "r2": self.r2,
+            "min_price": self.min_price,
+        }
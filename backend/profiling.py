@@ -0,0 +1,141 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import asyncio
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import asynccontextmanager
+
+# Sin token configurado el perfilado está apagado y no agrega ningún costo
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_DIR = os.getenv("PROFILING_DIR", "perfiles")
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.005"))
+PROFILING_TOP = int(os.getenv("PROFILING_TOP", "25"))
+
+
+class ProfilerBusyError(RuntimeError):
+    """Ya hay una valuación siendo perfilada."""
+
+
+def autorizado(token: str) -> bool:
+    return bool(PROFILING_TOKEN) and hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+
+class SamplingProfiler:
+    """
+    Perfilador por muestreo: un hilo toma el stack de todos los demás hilos
+    cada `interval` segundos y cuenta cuántas veces aparece cada uno.
+    Muestrea el proceso completo (event loop y executor de etapas), así que
+    otras requests concurrentes también aparecen en el perfil.
+    """
+
+    def __init__(self, interval: float = PROFILING_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+
+_activo = asyncio.Lock()
+
+
+@asynccontextmanager
+async def perfilar():
+    """
+    Perfila lo que corre dentro del bloque (CPU por muestreo + tracemalloc)
+    y guarda el resultado en PROFILING_DIR/<id>. Entrega el id del perfil.
+    Un perfil a la vez: si hay otro en curso lanza ProfilerBusyError.
+    """
+    if _activo.locked():
+        raise ProfilerBusyError("Ya hay un perfil en curso, intente más tarde")
+
+    async with _activo:
+        perfil_id = uuid.uuid4().hex
+        ya_trazando = tracemalloc.is_tracing()
+        if not ya_trazando:
+            tracemalloc.start()
+        antes = tracemalloc.take_snapshot()
+        profiler = SamplingProfiler()
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            yield perfil_id
+        finally:
+            samples = profiler.stop()
+            duracion = time.perf_counter() - started
+            despues = tracemalloc.take_snapshot()
+            if not ya_trazando:
+                tracemalloc.stop()
+            await asyncio.to_thread(_guardar, perfil_id, samples, antes, despues, duracion)
+
+
+def _guardar(perfil_id: str, samples: Counter, antes, despues, duracion: float):
+    directorio = os.path.join(PROFILING_DIR, perfil_id)
+    os.makedirs(directorio, exist_ok=True)
+
+    # Formato "collapsed stacks": se abre directo en speedscope o flamegraph.pl
+    with open(os.path.join(directorio, "cpu.collapsed"), "w", encoding="utf-8") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+
+    asignaciones = [
+        {
+            "sitio": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "kib": round(stat.size_diff / 1024, 1),
+            "bloques": stat.count_diff,
+        }
+        for stat in despues.compare_to(antes, "lineno")[:PROFILING_TOP]
+    ]
+
+    total = sum(samples.values())
+    resumen = {
+        "perfil_id": perfil_id,
+        "duracion_segundos": round(duracion, 3),
+        "muestras": total,
+        "intervalo_segundos": PROFILING_INTERVAL,
+        "stacks_principales": [
+            {"stack": stack, "muestras": count, "porcentaje": round(100 * count / total, 1)}
+            for stack, count in samples.most_common(PROFILING_TOP)
+        ],
+        "asignaciones_principales": asignaciones,
+    }
+    with open(os.path.join(directorio, "resumen.json"), "w", encoding="utf-8") as f:
+        json.dump(resumen, f, ensure_ascii=False, indent=2)
+
+
+def ruta_perfil(perfil_id: str, archivo: str):
+    """Ruta de un archivo del perfil, o None si el id no es válido o no existe."""
+    try:
+        uuid.UUID(hex=perfil_id)
+    except ValueError:
+        return None
+    ruta = os.path.join(PROFILING_DIR, perfil_id, archivo)
+    return ruta if os.path.exists(ruta) else None
@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+
+PROGRESS_BUS = os.getenv("PROGRESS_BUS", "memory")
+PROGRESS_BUS_PATH = os.getenv("PROGRESS_BUS_PATH", "progress_bus.sqlite3")
+PROGRESS_BUS_POLL = float(os.getenv("PROGRESS_BUS_POLL", "0.05"))
+PROGRESS_BUS_RETENTION = float(os.getenv("PROGRESS_BUS_RETENTION", "60"))
+
+
+class InMemoryProgressBus:
+    """
+    Pub/sub de mensajes de progreso por session_id dentro de un proceso.
+    El worker que tiene el WebSocket se suscribe; cualquier valuación publica.
+    """
+
+    def __init__(self):
+        self._subscribers = {}  # session_id -> corrutina que entrega el mensaje
+
+    def subscribe(self, session_id: str, deliver):
+        self._subscribers[session_id] = deliver
+
+    def unsubscribe(self, session_id: str, deliver=None):
+        # Con `deliver` solo se quita si sigue siendo esa suscripción (el cliente pudo reconectarse)
+        if deliver is None or self._subscribers.get(session_id) is deliver:
+            self._subscribers.pop(session_id, None)
+
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    async def publish(self, session_id: str, message: str):
+        await self._deliver_local(session_id, message)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def _deliver_local(self, session_id: str, message: str) -> bool:
+        deliver = self._subscribers.get(session_id)
+        if deliver is None:
+            return False
+        await deliver(message)
+        return True
+
+
+class SQLiteProgressBus(InMemoryProgressBus):
+    """
+    Bus compartido entre workers de la misma máquina usando una tabla SQLite.
+
+    Si el WebSocket está en este mismo worker el mensaje se entrega directo;
+    si no, se escribe en la tabla y el worker que tiene la conexión lo
+    recoge en su siguiente sondeo.
+    """
+
+    def __init__(self, path: str = PROGRESS_BUS_PATH, poll: float = PROGRESS_BUS_POLL, retention: float = PROGRESS_BUS_RETENTION):
+        super().__init__()
+        self.poll = poll
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS progress_events ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " message TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._last_id = 0
+        self._task = None
+
+    async def publish(self, session_id: str, message: str):
+        if not await self._deliver_local(session_id, message):
+            await asyncio.to_thread(self._insert, session_id, message)
+
+    async def start(self):
+        # Solo interesan los eventos publicados desde ahora
+        self._last_id = await asyncio.to_thread(self._max_id)
+        self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._lock:
+            self._db.close()
+
+    async def _poll_loop(self):
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                if self._subscribers:
+                    for event_id, session_id, message in await asyncio.to_thread(self._fetch_new):
+                        self._last_id = event_id
+                        await self._deliver_local(session_id, message)
+                else:
+                    # Sin sockets locales no hay nada que entregar: solo avanzar el cursor
+                    self._last_id = await asyncio.to_thread(self._max_id)
+
+                if time.monotonic() - last_cleanup > self.retention:
+                    await asyncio.to_thread(self._cleanup)
+                    last_cleanup = time.monotonic()
+            except Exception as e:
+                print(f"Error en el bus de progreso: {e}")
+
+    def _insert(self, session_id: str, message: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO progress_events (session_id, message, created_at) VALUES (?, ?, ?)",
+                (session_id, message, time.time())
+            )
+
+    def _fetch_new(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, session_id, message FROM progress_events WHERE id > ? ORDER BY id",
+                (self._last_id,)
+            ).fetchall()
+
+    def _max_id(self) -> int:
+        with self._lock:
+            (max_id,) = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM progress_events").fetchone()
+        return max_id
+
+    def _cleanup(self):
+        with self._lock:
+            self._db.execute("DELETE FROM progress_events WHERE created_at < ?", (time.time() - self.retention,))
+
+
+def crear_progress_bus():
+    if PROGRESS_BUS == "sqlite":
+        return SQLiteProgressBus()
+    return InMemoryProgressBus()
+
+
+progress_bus = crear_progress_bus()
@@ -0,0 +1,207 @@
+import os
+import math
+import time
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime, time as dtime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from stages import OverloadedError, run_stage
+
+GOOGLE_QUOTA_PATH = os.getenv("GOOGLE_QUOTA_PATH", "google_quota.sqlite3")
+# Límites de Custom Search: consultas por segundo (con ráfaga) y por día
+GOOGLE_QUOTA_PER_SECOND = float(os.getenv("GOOGLE_QUOTA_PER_SECOND", "1.5"))
+GOOGLE_QUOTA_BURST = float(os.getenv("GOOGLE_QUOTA_BURST", "5"))
+GOOGLE_QUOTA_PER_DAY = int(os.getenv("GOOGLE_QUOTA_PER_DAY", "100"))
+# Fracción de la cuota diaria reservada para búsquedas que no tienen nada cacheado
+GOOGLE_QUOTA_RESERVE = float(os.getenv("GOOGLE_QUOTA_RESERVE", "0.2"))
+# Espera máxima por el límite por segundo antes de rendirse
+GOOGLE_QUOTA_MAX_WAIT = float(os.getenv("GOOGLE_QUOTA_MAX_WAIT", "5"))
+# La cuota diaria de Google se reinicia a medianoche, hora del Pacífico
+GOOGLE_QUOTA_TZ = os.getenv("GOOGLE_QUOTA_TZ", "America/Los_Angeles")
+
+# Sin datos con qué responder: puede usar toda la cuota diaria
+INTERACTIVA = "interactiva"
+# Con cache o store de respaldo (refrescos, precalentamiento): no toca la reserva
+RESPALDADA = "respaldada"
+
+
+class QuotaExceededError(OverloadedError):
+    """No queda cuota de la API de búsqueda; `retry_after` son los segundos sugeridos para reintentar."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def _zona(nombre: str):
+    try:
+        return ZoneInfo(nombre)
+    except ZoneInfoNotFoundError:
+        print(f"Zona horaria {nombre} no disponible, la cuota diaria se reinicia en UTC")
+        return timezone.utc
+
+
+class QuotaManager:
+    """
+    Cuota de la API de Google compartida por todos los workers de la
+    máquina (una fila en SQLite, consumida dentro de una transacción).
+
+    Dos baldes de tokens: uno por segundo (tasa `per_second`, ráfaga
+    `burst`) y uno diario de `per_day` consultas que se llena de nuevo en
+    cada reinicio. Las consultas RESPALDADAS solo usan la cuota diaria por
+    sobre la reserva: cuando escasea, lo que tiene cache se responde desde
+    la cache y lo que queda es para las búsquedas que no tienen nada.
+    """
+
+    def __init__(self, path: str = GOOGLE_QUOTA_PATH, per_second: float = GOOGLE_QUOTA_PER_SECOND,
+                 burst: float = GOOGLE_QUOTA_BURST, per_day: int = GOOGLE_QUOTA_PER_DAY,
+                 reserve: float = GOOGLE_QUOTA_RESERVE, tz: str = GOOGLE_QUOTA_TZ):
+        self.per_second = per_second
+        self.burst = max(1.0, burst)
+        self.per_day = per_day
+        self.reserve = reserve
+        self.tz = _zona(tz)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS google_quota ("
+            " id INTEGER PRIMARY KEY CHECK (id = 1),"
+            " tokens REAL NOT NULL,"
+            " refilled_at REAL NOT NULL,"
+            " day TEXT NOT NULL,"
+            " used_today INTEGER NOT NULL)"
+        )
+        now = time.time()
+        self._db.execute("INSERT OR IGNORE INTO google_quota VALUES (1, ?, ?, ?, 0)", (self.burst, now, self._day(now)))
+        self.stats = {"concedidas": 0, "esperas": 0, "sin_cuota_diaria": 0, "sin_cuota_respaldadas": 0,
+                      "sin_cuota_por_segundo": 0, "agotada_por_google": 0}
+
+    def _day(self, now: float) -> str:
+        return datetime.fromtimestamp(now, self.tz).date().isoformat()
+
+    def seconds_to_reset(self, now: float = None) -> float:
+        now = time.time() if now is None else now
+        local = datetime.fromtimestamp(now, self.tz)
+        manana = datetime.combine(local.date() + timedelta(days=1), dtime(), self.tz)
+        return manana.timestamp() - now
+
+    def _state(self, now: float):
+        """(tokens por segundo disponibles, consultas usadas hoy) a la hora `now`."""
+        tokens, refilled_at, day, used = self._db.execute(
+            "SELECT tokens, refilled_at, day, used_today FROM google_quota WHERE id = 1"
+        ).fetchone()
+        tokens = min(self.burst, tokens + max(0.0, now - refilled_at) * self.per_second)
+        return tokens, used if day == self._day(now) else 0
+
+    def _limite(self, prioridad: str) -> float:
+        return self.per_day if prioridad == INTERACTIVA else self.per_day * (1 - self.reserve)
+
+    def take(self, prioridad: str = INTERACTIVA) -> float:
+        """
+        Consume una consulta si hay cuota. Devuelve 0 si se concedió, o los
+        segundos a esperar por el límite por segundo. Lanza
+        QuotaExceededError si se acabó la cuota diaria disponible para
+        esta prioridad.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, used = self._state(now)
+                sin_cuota = used >= self._limite(prioridad)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / self.per_second
+                if not sin_cuota and wait == 0:
+                    self._db.execute(
+                        "UPDATE google_quota SET tokens = ?, refilled_at = ?, day = ?, used_today = ? WHERE id = 1",
+                        (tokens - 1, now, self._day(now), used + 1)
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+        if sin_cuota:
+            self.stats["sin_cuota_diaria" if prioridad == INTERACTIVA else "sin_cuota_respaldadas"] += 1
+            raise QuotaExceededError("Cuota diaria de búsquedas agotada, intente más tarde", self.seconds_to_reset(now))
+        if wait == 0:
+            self.stats["concedidas"] += 1
+        return wait
+
+    async def acquire(self, prioridad: str = INTERACTIVA, max_wait: float = GOOGLE_QUOTA_MAX_WAIT):
+        """Espera (hasta `max_wait` segundos) un token para una consulta a la API."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = await run_stage("store", self.take, prioridad)
+            if wait == 0:
+                return
+            self._esperar_o_rendirse(wait, deadline)
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self, prioridad: str = INTERACTIVA, max_wait: float = GOOGLE_QUOTA_MAX_WAIT):
+        """Versión síncrona de `acquire` para el cliente HTTP bloqueante."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.take(prioridad)
+            if wait == 0:
+                return
+            self._esperar_o_rendirse(wait, deadline)
+            time.sleep(wait)
+
+    def _esperar_o_rendirse(self, wait: float, deadline: float):
+        if time.monotonic() + wait > deadline:
+            self.stats["sin_cuota_por_segundo"] += 1
+            raise QuotaExceededError("Límite de búsquedas por segundo saturado, intente más tarde", wait)
+        self.stats["esperas"] += 1
+
+    def agotar(self) -> float:
+        """
+        Da por consumida la cuota de hoy: Google respondió que se acabó (la
+        clave puede usarse desde otras máquinas, que este contador no ve).
+        Devuelve los segundos hasta el reinicio.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, used = self._state(now)
+                self._db.execute(
+                    "UPDATE google_quota SET tokens = ?, refilled_at = ?, day = ?, used_today = ? WHERE id = 1",
+                    (tokens, now, self._day(now), max(used, self.per_day))
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        self.stats["agotada_por_google"] += 1
+        return self.seconds_to_reset(now)
+
+    def remaining_today(self) -> int:
+        with self._lock:
+            _, used = self._state(time.time())
+        return max(0, self.per_day - used)
+
+    def report(self) -> dict:
+        now = time.time()
+        with self._lock:
+            tokens, used = self._state(now)
+        return {
+            "por_segundo": {"tasa": self.per_second, "rafaga": self.burst, "disponibles": round(tokens, 2)},
+            "por_dia": {
+                "limite": self.per_day,
+                "usadas": used,
+                "restantes": max(0, self.per_day - used),
+                "reserva": int(self.per_day * self.reserve),
+                "reinicio_en_segundos": int(self.seconds_to_reset(now)),
+            },
+            "estadisticas": self.stats,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+quota = QuotaManager()
@@ -1,13 +1,41 @@
+import os
 import re
+import math
+from functools import lru_cache
+from contextlib import aclosing
 # import json
 import asyncio
 # import urllib.parse
-import pandas as pd
 
-from get_google_info import google_api_scrap
+from get_google_info import google_api_pages
+import get_ml_info
+from quota import QuotaExceededError, INTERACTIVA, RESPALDADA
+from stages import run_stage
+from listing_cache import listing_cache, normalizar_query
+from single_flight import SingleFlight
+from listings_store import listings_store
+from price_models import price_models
+from metrics import medir_etapa
+from warmup import pandas, numpy
 #google_scrap, 
 # from get_ml_info import ml_scrap, ml_scrap_sync
 
+listing_flight = SingleFlight()
+
+# Recolección adaptativa: se piden páginas hasta tener una muestra suficiente
+LISTING_MAX_PAGES = int(os.getenv("LISTING_MAX_PAGES", "5"))
+LISTING_TARGET_COMPARABLES = int(os.getenv("LISTING_TARGET_COMPARABLES", "20"))
+# Error estándar relativo del precio medio con el que ya no vale la pena seguir paginando
+LISTING_TARGET_REL_ERROR = float(os.getenv("LISTING_TARGET_REL_ERROR", "0.05"))
+
+# Plazo de cada fuente: la valuación sigue con las que respondieron a tiempo
+LISTING_DEADLINE_GOOGLE = float(os.getenv("LISTING_DEADLINE_GOOGLE", "15"))
+LISTING_DEADLINE_ML = float(os.getenv("LISTING_DEADLINE_ML", "20"))
+
+collection_stats = {"searches": 0, "pages": 0, "target_reached": 0, "exhausted": 0, "quota_limited": 0, "deadline": 0,
+                    "upstream_errors": 0}
+source_stats = {source: {"ok": 0, "timeouts": 0, "errors": 0, "rows": 0} for source in ("google_cse", "mercadolibre")}
+
 def custom_split(text, symbol):
     splitted_text = text.split(symbol)
     custom_result = []
@@ -19,43 +47,78 @@ def custom_split(text, symbol):
     custom_result.append(" ".join(splitted_text[current_text_index:]))
     return custom_result
 
-def extract_custom_info(brand, model, text):
-    
-    def match_to_num(match):
-
-        if match:
-            value_str = match.group(0)
-            return int(re.sub(r'[^\d]', '', value_str))
-        return None
-
-    # 1️⃣ Extraer año
-    year_match = re.search(r'\b(19|20)\d{2}\b', text)
-    year = match_to_num(year_match)
-
-    # 2️⃣ Extraer precio
-    price_match = re.search(r'\$[\d\.]+', text)
-    price_num = match_to_num(price_match)
-
-    # 3️⃣ Extraer kilometraje
-    km_match = re.search(r'[\d\.]+\s*km', text, flags=re.IGNORECASE)
-    km = match_to_num(km_match)
-
-    # 4️⃣ Capturar versión específica del modelo si existe en el texto
-    model_detail = None
-    pattern = re.compile(rf'{brand}\s+{model}\s*(.*?)\s*(?:·|\$|$)', flags=re.IGNORECASE)
+YEAR_RE = re.compile(r'\b(?:19|20)\d{2}\b')
+PRICE_RE = re.compile(r'\$([\d\.]+)')
+# El lookbehind evita reintentar desde cada dígito de una misma cifra
+KM_RE = re.compile(r'(?<![\d\.])([\d\.]+)\s*km', flags=re.IGNORECASE)
+
+@lru_cache(maxsize=256)
+def model_pattern(brand, model):
+    """
+    Patrón "marca modelo <versión>" compilado una vez por búsqueda. Marca y
+    modelo se escapan (p. ej. "3.5" o "4x4" son literales) y cualquier
+    espacio entre palabras acepta uno o más espacios.
+    """
+    words = r'\s+'.join(re.escape(word) for word in f"{brand} {model}".split())
+    return re.compile(rf'{words}\s*(.*?)\s*(?:·|\$|$)', flags=re.IGNORECASE)
+
+def _int_array(values, missing):
+    np = numpy()
+    return pandas().arrays.IntegerArray(np.array(values, dtype=np.int64), np.array(missing, dtype=bool))
+
+def _extract_fields(pattern, text):
+    """(año, precio, km, versión) de un texto; None donde no aparece."""
+    # 1️⃣ Año
+    m = YEAR_RE.search(text)
+    year = int(m.group(0)) if m else None
+
+    # 2️⃣ Precio y 3️⃣ kilometraje ("$9.500.000", "80.000 km")
+    m = PRICE_RE.search(text)
+    digits = m.group(1).replace('.', '') if m else ''
+    price = int(digits) if digits else None
+    m = KM_RE.search(text)
+    digits = m.group(1).replace('.', '') if m else ''
+    km = int(digits) if digits else None
+
+    # 4️⃣ Versión específica del modelo si existe en el texto
     m = pattern.search(text)
-    if m:
-        model_detail = m.group(1).strip() if m.group(1).strip() else None
-
-    # Combinar resultados
-    return {
-        "year": year,
-        "price": price_num,
-        "km": km,
-        "brand": brand,
-        "model": model,
-        "model_detail": model_detail
-    }
+    detail = (m.group(1).strip() or None) if m else None
+    return year, price, km, detail
+
+def extract_listings(brand, model, texts):
+    """
+    Extrae año, precio, km y versión de todos los textos de una vez.
+    Devuelve un DataFrame columnar tipado (Int64 para los números).
+    """
+    pattern = model_pattern(brand, model)
+    n = len(texts)
+    years, prices, kms = [0] * n, [0] * n, [0] * n
+    no_year, no_price, no_km = [True] * n, [True] * n, [True] * n
+    details = [None] * n
+
+    for i, text in enumerate(texts):
+        year, price, km, details[i] = _extract_fields(pattern, text)
+        if year is not None:
+            years[i], no_year[i] = year, False
+        if price is not None:
+            prices[i], no_price[i] = price, False
+        if km is not None:
+            kms[i], no_km[i] = km, False
+
+    pd = pandas()
+    return pd.DataFrame({
+        "year": _int_array(years, no_year),
+        "price": _int_array(prices, no_price),
+        "km": _int_array(kms, no_km),
+        "brand": pd.Categorical([brand] * n),
+        "model": pd.Categorical([model] * n),
+        "model_detail": pd.array(details, dtype="string"),
+    })
+
+def extract_custom_info(brand, model, text):
+    """Un solo texto, como dict: los mismos patrones que `extract_listings`, sin armar un DataFrame."""
+    year, price, km, detail = _extract_fields(model_pattern(brand, model), text)
+    return {"year": year, "price": price, "km": km, "brand": brand, "model": model, "model_detail": detail}
 
 # def scrap_chileautos(query, max_pages=5):
 
@@ -160,20 +223,200 @@ def extract_custom_info(brand, model, text):
 
 #     return pd.DataFrame(results)
 
-def scrap_pipeline_async(brand, model, year):
+async def scrap_pipeline_async(brand, model, year):
+    # Publicaciones cacheadas por búsqueda; si vencieron se refrescan en segundo plano
+    # Búsquedas idénticas en curso comparten un solo fetch a Google
+    key = normalizar_query(brand, model, year)
+    return await listing_cache.get_or_fetch(
+        key,
+        lambda: listing_flight.do(key, lambda: fetch_listing_rows(brand, model, year))
+    )
+
+async def refresh_listings(brand, model, year, force=False, presupuesto=None):
+    """
+    Refresca la cache de publicaciones de una búsqueda (precalentamiento).
+    Con `force` se consulta Google aunque el store tenga cobertura. Cada
+    llamada a Google toma un token de `presupuesto`, si se pasa uno.
+    """
+    key = normalizar_query(brand, model, year)
+    await listing_cache.refresh(
+        key,
+        lambda: listing_flight.do(key, lambda: fetch_listing_rows(brand, model, year, force=force,
+                                                                  presupuesto=presupuesto))
+    )
+
+async def fetch_listing_rows(brand, model, year, force=False, presupuesto=None):
+    brand, model, year = normalizar_query(brand, model, year)
+
+    # Primero el store local; solo se scrapea si hay pocos comparables recientes
+    stored = await run_stage("store", listings_store.comparables, brand, model, year)
+    if not force and listings_store.has_coverage(stored):
+        return stored
+
+    # Con algo cacheado para responder, la búsqueda no compite por la reserva de cuota
+    respaldada = force or len(stored) > 0 or listing_cache.freshness_left((brand, model, year)) is not None
+    sources = {"google_cse": collect_listings(brand, model, year, stored, RESPALDADA if respaldada else INTERACTIVA,
+                                              presupuesto=presupuesto)}
+    if get_ml_info.disponible():
+        sources["mercadolibre"] = collect_ml_listings(brand, model, year)
+    scraped, errors = await gather_sources(sources)
+
+    if not scraped:
+        # Ninguna fuente respondió: se sigue con lo guardado, o se propaga el error (p. ej. sin cuota → 503)
+        if len(stored) == 0:
+            raise errors[0]
+        print(f"Sin fuentes disponibles: {brand} {model} {year} sigue con {len(stored)} publicaciones guardadas")
+        return stored
+
+    for source, df in scraped.items():
+        nuevas = await run_stage("store", listings_store.append, brand, model, df, source)
+        # Solo las publicaciones nunca vistas suman a los modelos de precio
+        await run_stage("store", price_models.update, brand, model, nuevas)
+
+    # Lo recién scrapeado más lo que ya había; los duplicados se eliminan al filtrar comparables
+    frames = [df for df in (*scraped.values(), stored) if len(df)]
+    if len(frames) < 2:
+        return frames[0] if frames else next(iter(scraped.values()))
+    return pandas().concat(frames, ignore_index=True)
+
+async def gather_sources(sources):
+    """
+    Corre las fuentes en paralelo; cada una ya está acotada por su propio
+    plazo. Devuelve ({fuente: DataFrame} de las que respondieron, errores
+    de las que no, en el orden de `sources`).
+    """
+    results = await asyncio.gather(*sources.values(), return_exceptions=True)
+    scraped, errors = {}, []
+    for source, result in zip(sources, results):
+        stats = source_stats[source]
+        if isinstance(result, TimeoutError):
+            stats["timeouts"] += 1
+            print(f"La fuente {source} no respondió a tiempo")
+        elif isinstance(result, Exception):
+            stats["errors"] += 1
+            print(f"Error en la fuente {source}: {result}")
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            stats["ok"] += 1
+            stats["rows"] += len(result)
+            scraped[source] = result
+            continue
+        errors.append(result)
+    return scraped, errors
+
+async def listing_pages(brand, model, year, max_pages=LISTING_MAX_PAGES, prioridad=INTERACTIVA, presupuesto=None):
+    """Genera un DataFrame parseado por cada página de resultados de Google, a medida que llegan."""
     query_ca = " ".join([brand, model, str(year)])
-    cars_ca = google_api_scrap(query_ca)
-   
-    results = []
-
-    # Procesar ChileAutos
-    for car_info in cars_ca:
-        print(car_info["title"]+' '+car_info["snippet"])
-        for sub_text in custom_split(car_info["title"]+' '+car_info["snippet"], ";"):
-            print('st', sub_text)
-            results.append(extract_custom_info(brand, model, sub_text))
-
-    return pd.DataFrame(results)
+    async with aclosing(google_api_pages(query_ca, max_pages, prioridad, presupuesto)) as pages:
+        async for cars_ca in pages:
+            # El parseo es CPU: fuera del event loop
+            yield await run_stage("pandas", parse_google_items, brand, model, cars_ca)
+
+def comparables_summary(frames, year):
+    """(n, error estándar relativo del precio medio) de los comparables utilizables en `frames`."""
+    frames = [df for df in frames if len(df)]
+    if not frames:
+        return 0, math.inf
+    df = pandas().concat(frames, ignore_index=True)
+    prices = df[(df.price.notna()) & (df.year == year) & (df.price > 1e6)].drop_duplicates().price.astype(float)
+    n = len(prices)
+    if n < 2 or prices.mean() <= 0:
+        return n, math.inf
+    return n, prices.std() / math.sqrt(n) / prices.mean()
+
+def sample_is_enough(n, rel_error):
+    return n >= listings_store.min_comparables and (n >= LISTING_TARGET_COMPARABLES or rel_error <= LISTING_TARGET_REL_ERROR)
+
+async def collect_listings(brand, model, year, stored, prioridad=INTERACTIVA, deadline=LISTING_DEADLINE_GOOGLE,
+                           presupuesto=None):
+    """
+    Pide páginas solo mientras la muestra (lo guardado más lo recién
+    parseado) no alcance el tamaño o la precisión objetivo: con buena
+    cobertura basta una página y la cuota se gasta donde la muestra es escasa.
+
+    Si se acaba la cuota o el plazo, o falla una página (error HTTP, de red
+    o circuito abierto), se devuelven las páginas ya recolectadas; sin
+    ninguna se propaga el error.
+    """
+    collection_stats["searches"] += 1
+    frames = []
+    pages = listing_pages(brand, model, year, prioridad=prioridad, presupuesto=presupuesto)
+    try:
+        async with asyncio.timeout(deadline), aclosing(pages):
+            async for page in pages:
+                collection_stats["pages"] += 1
+                frames.append(page)
+                sample = await run_stage("pandas", comparables_summary, [stored, *frames], year)
+                if sample_is_enough(*sample):
+                    collection_stats["target_reached"] += 1
+                    break
+            else:
+                collection_stats["exhausted"] += 1
+    except Exception as e:
+        if not frames:
+            raise
+        if isinstance(e, QuotaExceededError):
+            collection_stats["quota_limited"] += 1
+        elif isinstance(e, TimeoutError):
+            collection_stats["deadline"] += 1
+        else:
+            collection_stats["upstream_errors"] += 1
+        print(f"{str(e) or 'Plazo de Google agotado'}: {brand} {model} {year} sigue con {len(frames)} páginas de Google")
+
+    if not frames:
+        return parse_google_items(brand, model, [])
+    return pandas().concat(frames, ignore_index=True)
+
+async def collect_ml_listings(brand, model, year, deadline=LISTING_DEADLINE_ML):
+    """Publicaciones de MercadoLibre de la marca/modelo/año, dentro del plazo de la fuente."""
+    async with asyncio.timeout(deadline):
+        cars_ml = await get_ml_info.ml_listings(" ".join([brand, model, str(year)]))
+    return await run_stage("pandas", parse_ml_items, brand, model, cars_ml)
+
+def _digits(text):
+    digits = re.sub(r'[^\d]', '', text or '')
+    return int(digits) if digits else None
+
+def parse_ml_items(brand, model, cars_ml):
+    """
+    Publicaciones de MercadoLibre (título, precio, año y km ya separados)
+    al mismo DataFrame columnar que `extract_listings`. Los resultados
+    cuyo título no es de la marca/modelo buscados se descartan.
+    """
+    with medir_etapa("extraccion"):
+        pattern = model_pattern(brand, model)
+        years, prices, kms, details = [], [], [], []
+        for car_info in cars_ml:
+            m = pattern.search(car_info.get("model") or "")
+            if m is None:
+                continue
+            details.append(m.group(1).strip() or None)
+            year = YEAR_RE.search(car_info.get("year") or "")
+            years.append(int(year.group(0)) if year else None)
+            prices.append(_digits(car_info.get("price")))
+            km = car_info.get("km") or ""
+            kms.append(_digits(km) if "km" in km.lower() else None)
+
+        n = len(details)
+        pd = pandas()
+        return pd.DataFrame({
+            "year": pd.array(years, dtype="Int64"),
+            "price": pd.array(prices, dtype="Int64"),
+            "km": pd.array(kms, dtype="Int64"),
+            "brand": pd.Categorical([brand] * n),
+            "model": pd.Categorical([model] * n),
+            "model_detail": pd.array(details, dtype="string"),
+        })
+
+def parse_google_items(brand, model, cars_ca):
+    # Procesar ChileAutos: todos los sub-textos de todos los resultados en un solo lote
+    with medir_etapa("extraccion"):
+        texts = []
+        for car_info in cars_ca:
+            texts.extend(custom_split(car_info["title"]+' '+car_info["snippet"], ";"))
+
+        return extract_listings(brand, model, texts)
 
 if __name__ == "__main__":
     # brand = "honda"
@@ -0,0 +1,33 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave: la primera lanza el
+    fetch y las demás esperan ese mismo resultado (o excepción).
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    async def do(self, key, fetch):
+        """`fetch` es una función sin argumentos que devuelve una corrutina."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["followers"] += 1
+
+        # shield: si un llamador se cancela (cliente desconectado) el resto sigue esperando
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Marcar la excepción como leída aunque todos los llamadores se hayan cancelado
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,90 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+EXECUTOR_WORKERS = int(os.getenv("STAGE_EXECUTOR_WORKERS", "8"))
+
+# Máximo de llamadas concurrentes por etapa bloqueante (Selenium, pandas/regresión, SQLite)
+STAGE_LIMITS = {
+    "patente": int(os.getenv("STAGE_LIMIT_PATENTE", os.getenv("PATENTE_POOL_SIZE", "2"))),
+    "pandas": int(os.getenv("STAGE_LIMIT_PANDAS", "2")),
+    "store": int(os.getenv("STAGE_LIMIT_STORE", "2")),
+}
+
+MAX_EN_CURSO = int(os.getenv("MAX_VALUACIONES_EN_CURSO", "16"))
+MAX_EN_COLA = int(os.getenv("MAX_VALUACIONES_EN_COLA", "32"))
+COLA_TIMEOUT = float(os.getenv("VALUACION_COLA_TIMEOUT", "30"))
+
+
+class OverloadedError(RuntimeError):
+    """El servidor está a capacidad y la valuación no fue admitida."""
+
+
+_executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="stage")
+_semaphores = {}
+
+
+def _semaphore(stage: str) -> asyncio.Semaphore:
+    if stage not in _semaphores:
+        _semaphores[stage] = asyncio.Semaphore(STAGE_LIMITS.get(stage, EXECUTOR_WORKERS))
+    return _semaphores[stage]
+
+
+async def run_stage(stage: str, func, *args, **kwargs):
+    """
+    Ejecuta `func` (bloqueante) en el executor compartido, respetando el
+    límite de concurrencia de su etapa, sin bloquear el event loop.
+    """
+    async with _semaphore(stage):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+class AdmissionControl:
+    """
+    Limita las valuaciones simultáneas. Sobre `max_en_curso` las nuevas
+    esperan en cola (hasta `max_en_cola` y `timeout` segundos); más allá
+    se rechazan con OverloadedError.
+    """
+
+    def __init__(self, max_en_curso: int = MAX_EN_CURSO, max_en_cola: int = MAX_EN_COLA, timeout: float = COLA_TIMEOUT):
+        self.max_en_curso = max_en_curso
+        self.max_en_cola = max_en_cola
+        self.timeout = timeout
+        self.en_curso = 0
+        self.en_cola = 0
+        self._slots = None
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_en_curso)
+
+        if self._slots.locked():
+            if self.en_cola >= self.max_en_cola:
+                raise OverloadedError("Demasiadas valuaciones en curso, intente más tarde")
+            self.en_cola += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise OverloadedError("Tiempo de espera en cola agotado, intente más tarde")
+            finally:
+                self.en_cola -= 1
+        else:
+            await self._slots.acquire()
+
+        self.en_curso += 1
+        try:
+            yield
+        finally:
+            self.en_curso -= 1
+            self._slots.release()
+
+
+admission = AdmissionControl()
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
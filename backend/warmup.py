@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import importlib
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+
+# Dependencias pesadas que los módulos importan recién al usarlas (ver benchmarks/cold_start.py)
+HEAVY_MODULES = ("numpy", "pandas", "httpx", "requests", "selenium.webdriver")
+
+# módulo -> segundos que tomó importarlo en segundo plano (0.0 si ya estaba, None si falló)
+import_times = {}
+
+
+def pandas():
+    """pandas, importado al primer uso: el único lugar desde donde los módulos lo cargan."""
+    import pandas
+    return pandas
+
+
+def numpy():
+    """numpy, importado al primer uso (ver `pandas()`)."""
+    import numpy
+    return numpy
+
+
+def warm_imports(modules=HEAVY_MODULES) -> dict:
+    """Importa las dependencias pesadas (se llama en un thread cuando el servidor ya acepta tráfico)."""
+    for name in modules:
+        if name in sys.modules:
+            import_times.setdefault(name, 0.0)
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"No se pudo precargar {name}: {e}")
+            import_times[name] = None
+            continue
+        import_times[name] = round(time.perf_counter() - start, 3)
+    return import_times
+
+
+def warm_pipeline():
+    """
+    Precarga las dependencias y ejecuta una vez el parseo y la regresión
+    con datos mínimos, para que la primera valuación no pague la
+    inicialización perezosa de pandas.
+    """
+    start = time.perf_counter()
+    warm_imports()
+
+    from scrap_pipeline import extract_listings
+    from pricing import LinearPriceModel
+
+    try:
+        df = extract_listings("marca", "modelo", ["Marca Modelo 2020 · $10.000.000 · 50.000 km"])
+        df = df[(df.price.notna()) & (df.year == 2020)].drop_duplicates()
+        LinearPriceModel.fit(df["km"], df["price"]).predict(60000)
+    except Exception as e:
+        print(f"Error precalentando el pipeline: {e}")
+    import_times["total"] = round(time.perf_counter() - start, 3)
+
+
+def report() -> dict:
+    pendientes = [name for name in HEAVY_MODULES if name not in sys.modules]
+    return {"segundos": dict(import_times), "sin_cargar": pendientes}
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from progress_bus import progress_bus
+
+# Mensajes pendientes por cliente; sobre eso se conserva solo el último progreso
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "16"))
+# Un envío que tarda más que esto significa un cliente trabado: se desconecta
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+# Sin progreso ni mensajes del cliente por este tiempo, la conexión se cierra
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))
+
+
+class Connection:
+    """Un WebSocket de progreso con su cola de envío acotada."""
+
+    def __init__(self, websocket: WebSocket, session_id: str, max_pendientes: int, stats: dict):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.max_pendientes = max_pendientes
+        self.last_activity = time.monotonic()
+        self._stats = stats
+        self._pendientes = deque()
+        self._hay_mensajes = asyncio.Event()
+
+        async def deliver(message: str):
+            self.enqueue(message)
+
+        # Se registra en el bus tal cual; el bus la compara por identidad al desuscribir
+        self.deliver = deliver
+
+    def enqueue(self, message: str):
+        """Nunca bloquea a quien publica: el envío real lo hace la tarea escritora."""
+        if len(self._pendientes) >= self.max_pendientes:
+            # Cliente atrasado: cada progreso reemplaza a los anteriores, basta el último
+            self._stats["coalescidos"] += len(self._pendientes)
+            self._pendientes.clear()
+        self._pendientes.append(message)
+        self._stats["encolados"] += 1
+        self.last_activity = time.monotonic()
+        self._hay_mensajes.set()
+
+    async def esperar_mensajes(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._hay_mensajes.wait(), timeout)
+        except TimeoutError:
+            return False
+        self._hay_mensajes.clear()
+        return True
+
+    def sacar(self):
+        return self._pendientes.popleft() if self._pendientes else None
+
+
+class ConnectionManager:
+    """
+    WebSockets de progreso de este worker. Cada conexión tiene una cola de
+    envío acotada y una tarea escritora: las valuaciones solo encolan (vía
+    el bus de progreso) y un cliente lento nunca las frena. Si la cola se
+    llena se conserva solo el último progreso. La escritora manda un
+    heartbeat cuando no hay nada que enviar, y cierra la conexión si un
+    envío se traba o si pasa `idle_timeout` sin actividad.
+    """
+
+    def __init__(self, bus=progress_bus, max_pendientes: int = WS_SEND_QUEUE, send_timeout: float = WS_SEND_TIMEOUT,
+                 heartbeat: float = WS_HEARTBEAT_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT):
+        self.bus = bus
+        self.max_pendientes = max_pendientes
+        self.send_timeout = send_timeout
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self._connections = set()
+        self.stats = {"conexiones": 0, "encolados": 0, "enviados": 0, "coalescidos": 0, "heartbeats": 0,
+                      "cerradas_inactivas": 0, "cerradas_lentas": 0, "errores_envio": 0}
+
+    def abiertas(self) -> int:
+        return len(self._connections)
+
+    def report(self) -> dict:
+        return {**self.stats, "abiertas": self.abiertas()}
+
+    async def serve(self, websocket: WebSocket, session_id: str):
+        """Atiende el WebSocket hasta que el cliente se va o la conexión se desaloja."""
+        await websocket.accept()
+        conn = Connection(websocket, session_id, self.max_pendientes, self.stats)
+        self._connections.add(conn)
+        self.stats["conexiones"] += 1
+        self.bus.subscribe(session_id, conn.deliver)
+
+        reader = asyncio.create_task(self._reader(conn))
+        writer = asyncio.create_task(self._writer(conn))
+        try:
+            await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.bus.unsubscribe(session_id, conn.deliver)
+            self._connections.discard(conn)
+            for task in (reader, writer):
+                task.cancel()
+            await asyncio.gather(reader, writer, return_exceptions=True)
+
+    async def _reader(self, conn: Connection):
+        # Los mensajes del cliente solo mantienen viva la conexión
+        try:
+            while True:
+                await conn.websocket.receive_text()
+                conn.last_activity = time.monotonic()
+        except WebSocketDisconnect:
+            pass
+
+    async def _writer(self, conn: Connection):
+        try:
+            while True:
+                if not await conn.esperar_mensajes(self.heartbeat):
+                    if time.monotonic() - conn.last_activity > self.idle_timeout:
+                        self.stats["cerradas_inactivas"] += 1
+                        break
+                    await self._send(conn, json.dumps({"type": "heartbeat", "session_id": conn.session_id}))
+                    self.stats["heartbeats"] += 1
+                    continue
+
+                message = conn.sacar()
+                while message is not None:
+                    await self._send(conn, message)
+                    self.stats["enviados"] += 1
+                    message = conn.sacar()
+        except TimeoutError:
+            self.stats["cerradas_lentas"] += 1
+        except Exception as e:
+            self.stats["errores_envio"] += 1
+            print(f"Error enviando progreso a {conn.session_id}: {e}")
+            return
+
+        try:
+            await asyncio.wait_for(conn.websocket.close(code=1001), self.send_timeout)
+        except Exception:
+            pass
+
+    async def _send(self, conn: Connection, message: str):
+        await asyncio.wait_for(conn.websocket.send_text(message), self.send_timeout)
+
+
+connections = ConnectionManager()
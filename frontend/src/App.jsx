@@ -45,6 +45,8 @@ function App() {
     ws.onmessage = (event) => {
       try {
         const progressData = JSON.parse(event.data)
+        // El servidor manda heartbeats para mantener viva la conexión
+        if (progressData.type === 'heartbeat') return
         setProgress(progressData)
       } catch (err) {
         console.error('Error parsing progress data:', err)